@@ -0,0 +1,312 @@
+#!/usr/bin/env python
+"""Benchmark nb_to_pdf.py, nb_to_tex.py and nb_to_html.py on generated notebooks.
+
+Notebooks are generated with a given number of cells, markdown images,
+image size, size of code cell image outputs and number of citations.
+Latex is not run (nb_to_pdf.py converts to latex only) and the images of
+nb_to_tex.py are served from a local http server, pandoc is needed.
+Every conversion runs in a fresh process, reports throughput,
+latency percentiles and peak memory.
+
+Example:
+    ./benchmarks/bench_converters.py --cells 500 --markdown-images 20 --repeats 5
+    ./benchmarks/bench_converters.py --cells 500 --save-baseline before
+    ./benchmarks/bench_converters.py --cells 500 --compare before
+"""
+import os
+import sys
+import re
+import json
+import time
+import zlib
+import struct
+import base64
+import random
+import shutil
+import tempfile
+import argparse
+import threading
+from multiprocessing import Pool
+try:
+    from SimpleHTTPServer import SimpleHTTPRequestHandler
+    from BaseHTTPServer import HTTPServer
+except ImportError:
+    from http.server import SimpleHTTPRequestHandler, HTTPServer
+try:
+    import resource
+except ImportError:
+    resource = None
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+CONVERTERS = ('pdf', 'tex', 'html')
+BASELINES_FILENAME = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    'baselines.json')
+
+
+def make_png(width, height, rng):
+    """Valid png with random pixels (so it does not compress), no PIL needed."""
+    def chunk(chunk_type, data):
+        return (struct.pack('>I', len(data)) + chunk_type + data +
+            struct.pack('>I', zlib.crc32(chunk_type + data) & 0xffffffff))
+    row_bytes = width * 3
+    raw = b''.join(b'\x00' + bytes(bytearray(rng.getrandbits(8) for _ in range(row_bytes)))
+        for _ in range(height))
+    return (b'\x89PNG\r\n\x1a\n' +
+        chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)) +
+        chunk(b'IDAT', zlib.compress(raw)) + chunk(b'IEND', b''))
+
+def generate_notebook(out_dir, n_cells, n_markdown_images, image_size, output_size,
+        n_citations, image_url_prefix, seed=0):
+    """Write notebook, its local images and a bibtex file into out_dir.
+    Every third cell is a code cell with an image output of about output_size bytes.
+    Every other markdown cell starts with a header, the others can be batched
+    by nb_cell_cache.
+    Markdown images are referenced locally (![](...)) and remotely (<img src=...>).
+    Returns notebook filename and bibtex filename."""
+    rng = random.Random(seed)
+    image_dir = os.path.join(out_dir, 'images')
+    os.makedirs(image_dir)
+    image_names = []
+    for i_image in range(n_markdown_images):
+        image_name = 'image_%d.png' % i_image
+        with open(os.path.join(image_dir, image_name), 'wb') as image_file:
+            image_file.write(make_png(image_size, image_size, rng))
+        image_names.append(image_name)
+    output_width = max(1, int((output_size / 3.0) ** 0.5))
+    output_png = base64.b64encode(make_png(output_width, output_width, rng)).decode()
+
+    citations = dict()
+    bibtex_entries = []
+    for i_citation in range(n_citations):
+        key = 'cite2c/%08d' % i_citation
+        title = 'A Paper About Topic %d' % i_citation
+        citations[key] = dict(title=title, URL='http://example.org/paper%d' % i_citation)
+        bibtex_entries.append('@article{paper%d,\n title={%s},\n link={http://example.org/paper%d},\n'
+            ' author={Author, Some},\n year={2016}\n}\n' % (i_citation, title, i_citation))
+    bibtex_filename = os.path.join(out_dir, 'references.bib')
+    with open(bibtex_filename, 'w') as bibtex_file:
+        bibtex_file.write('\n'.join(bibtex_entries))
+
+    cells = []
+    citation_keys = sorted(citations)
+    i_markdown = 0
+    for i_cell in range(n_cells):
+        if i_cell % 3 == 2:
+            cells.append(dict(cell_type='code', execution_count=i_cell, metadata=dict(),
+                source='plot(x, y_%d)' % i_cell,
+                outputs=[dict(output_type='display_data', metadata=dict(),
+                    data={'image/png': output_png, 'text/plain': '<Figure>'})]))
+            continue
+        lines = ['Some text with *emphasis* and math $x^%d$.' % i_cell]
+        if i_markdown % 2 == 0:
+            lines = ['## Section %d' % i_cell, ''] + lines
+        if len(citation_keys) > 0:
+            lines.append('As shown before [](#cite-%s).' % citation_keys[i_markdown % len(citation_keys)])
+        if i_markdown < len(image_names):
+            lines.append('![Figure](images/%s)' % image_names[i_markdown])
+            lines.append('<img src="%s/%s"></img>' % (image_url_prefix, image_names[i_markdown]))
+        cells.append(dict(cell_type='markdown', metadata=dict(), source='\n'.join(lines)))
+        i_markdown += 1
+    notebook = dict(cells=cells, nbformat=4, nbformat_minor=0,
+        metadata=dict(cite2c=dict(citations=citations)))
+    notebook_filename = os.path.join(out_dir, 'Benchmark_Notebook.ipynb')
+    with open(notebook_filename, 'w') as notebook_file:
+        json.dump(notebook, notebook_file)
+    return notebook_filename, bibtex_filename
+
+def run_conversion(args):
+    """Convert once, in a fresh worker process.
+    Returns seconds and peak memory in megabytes of the process."""
+    converter, notebook_filename, bibtex_filename, out_dir = args
+    # import before timing, import time is not what we want to measure
+    import nb_to_pdf
+    import nb_to_tex
+    import nb_to_html
+    if converter == 'tex':
+        # written next to the notebook, remove output of the previous run
+        notebook_base_name = notebook_filename.replace('.ipynb', '')
+        for filename in (notebook_base_name + '.tex', notebook_base_name + '_files'):
+            if os.path.isdir(filename):
+                shutil.rmtree(filename)
+            elif os.path.exists(filename):
+                os.remove(filename)
+    start_time = time.time()
+    if converter == 'pdf':
+        nb_to_pdf.convert_notebook(notebook_filename, output_dir=out_dir,
+            exporter_class=nb_to_pdf.LatexExporter)
+    elif converter == 'tex':
+        nb_to_tex.convert_notebook(notebook_filename, bibtex_filename)
+    else:
+        nb_to_html.convert_notebook(notebook_filename,
+            os.path.join(out_dir, 'Benchmark_Notebook.html'))
+    seconds = time.time() - start_time
+    peak_rss_mb = None
+    if resource is not None:
+        peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+        if sys.platform == 'darwin':
+            peak_rss_mb = peak_rss_mb / 1024.0
+    check_output(converter, notebook_filename, out_dir)
+    return seconds, peak_rss_mb
+
+def check_output(converter, notebook_filename, out_dir):
+    """Raise ValueError unless every markdown cell was rendered and all images
+    were written, so broken output is never measured as a speedup."""
+    with open(notebook_filename, 'r') as notebook_file:
+        cells = json.load(notebook_file)['cells']
+    markdown_sources = [c['source'] for c in cells if c['cell_type'] == 'markdown']
+    image_names = sorted(set(name for source in markdown_sources
+        for name in re.findall(r'images/(image_\d+\.png)', source)))
+    notebook_base_name = os.path.basename(notebook_filename).replace('.ipynb', '')
+    if converter == 'html':
+        output_filename = os.path.join(out_dir, notebook_base_name + '.html')
+        emphasis, files_dir, image_names = '<em>emphasis</em>', None, []
+    elif converter == 'pdf':
+        output_filename = os.path.join(out_dir, notebook_base_name + '.tex')
+        emphasis = '\\emph{emphasis}'
+        files_dir = os.path.join(out_dir, notebook_base_name + '_files')
+        # directories of local images are joined into the name
+        image_names = ['images__' + name for name in image_names]
+    else:
+        output_filename = notebook_filename.replace('.ipynb', '.tex')
+        emphasis = '\\emph{emphasis}'
+        files_dir = os.path.join(os.path.dirname(notebook_filename),
+            notebook_base_name + '_files')
+    if not os.path.exists(output_filename):
+        raise ValueError("{:s}: {:s} was not written".format(converter, output_filename))
+    with open(output_filename, 'rb') as output_file:
+        output = output_file.read().decode('utf8')
+    if output.count(emphasis) != len(markdown_sources):
+        raise ValueError("{:s}: {:d} of {:d} markdown cells rendered in {:s}".format(
+            converter, output.count(emphasis), len(markdown_sources), output_filename))
+    missing = [name for name in image_names
+        if not os.path.exists(os.path.join(files_dir, name))]
+    if len(missing) > 0:
+        raise ValueError("{:s}: images {:s} missing in {:s}".format(
+            converter, ', '.join(missing), files_dir))
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+def summarize(seconds, peak_rss_mbs, n_cells):
+    mean_seconds = sum(seconds) / len(seconds)
+    rss = [r for r in peak_rss_mbs if r is not None]
+    return dict(n_runs=len(seconds), mean_seconds=mean_seconds,
+        p50_seconds=percentile(seconds, 0.5), p90_seconds=percentile(seconds, 0.9),
+        p99_seconds=percentile(seconds, 0.99), notebooks_per_second=1.0 / mean_seconds,
+        cells_per_second=n_cells / mean_seconds,
+        peak_rss_mb=max(rss) if len(rss) > 0 else None)
+
+def run_benchmark(converters, n_repeats, params):
+    work_dir = tempfile.mkdtemp(prefix='nb_bench')
+    server = HTTPServer(('127.0.0.1', 0), QuietHandler)
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+    old_dir = os.getcwd()
+    try:
+        image_url_prefix = 'http://127.0.0.1:%d/images' % server.server_address[1]
+        notebook_filename, bibtex_filename = generate_notebook(work_dir,
+            image_url_prefix=image_url_prefix, **params)
+        # http server serves the current directory
+        os.chdir(work_dir)
+        results = dict()
+        for converter in converters:
+            all_seconds, all_rss = [], []
+            for _ in range(n_repeats):
+                out_dir = tempfile.mkdtemp(dir=work_dir)
+                # fresh process for every run, so memory of runs is measured separately
+                pool = Pool(processes=1)
+                try:
+                    seconds, peak_rss_mb = pool.apply(run_conversion,
+                        ((converter, notebook_filename, bibtex_filename, out_dir),))
+                finally:
+                    pool.close()
+                    pool.join()
+                all_seconds.append(seconds)
+                all_rss.append(peak_rss_mb)
+            results[converter] = summarize(all_seconds, all_rss, params['n_cells'])
+        return results
+    finally:
+        os.chdir(old_dir)
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def print_results(results, baseline=None):
+    print('{:6s} {:>9s} {:>9s} {:>9s} {:>11s} {:>10s} {:>10s}'.format(
+        'conv', 'p50 [s]', 'p90 [s]', 'p99 [s]', 'cells/s', 'rss [MB]', 'vs base'))
+    for converter in sorted(results):
+        result = results[converter]
+        ratio = ''
+        if baseline is not None and converter in baseline:
+            ratio = '{:.2f}x'.format(result['p50_seconds'] / baseline[converter]['p50_seconds'])
+        print('{:6s} {:9.3f} {:9.3f} {:9.3f} {:11.1f} {:>10s} {:>10s}'.format(
+            converter, result['p50_seconds'], result['p90_seconds'],
+            result['p99_seconds'], result['cells_per_second'],
+            '-' if result['peak_rss_mb'] is None else '{:.1f}'.format(result['peak_rss_mb']),
+            ratio))
+
+def load_baselines():
+    if not os.path.exists(BASELINES_FILENAME):
+        return dict()
+    with open(BASELINES_FILENAME, 'r') as baselines_file:
+        return json.load(baselines_file)
+
+
+def parse_command_line_arguments():
+    parser = argparse.ArgumentParser(
+        description="""Benchmark the converters on generated notebooks.
+        Example: ./benchmarks/bench_converters.py --cells 500 --repeats 5"""
+    )
+    parser.add_argument('--converters', action='store', default=','.join(CONVERTERS),
+                        help='Comma separated converters to run, of pdf, tex, html.')
+    parser.add_argument('--cells', action='store', type=int, default=100,
+                        help='Number of cells, every third is a code cell with image output.')
+    parser.add_argument('--markdown-images', action='store', type=int, default=10,
+                        help='Number of markdown cells with images.')
+    parser.add_argument('--image-size', action='store', type=int, default=200,
+                        help='Width and height of markdown images in pixels.')
+    parser.add_argument('--output-size', action='store', type=int, default=50000,
+                        help='Size of every code cell image output in bytes.')
+    parser.add_argument('--citations', action='store', type=int, default=20,
+                        help='Number of cite2c citations (and bibtex entries).')
+    parser.add_argument('--repeats', action='store', type=int, default=3,
+                        help='Number of runs per converter.')
+    parser.add_argument('--save-baseline', action='store', default=None,
+                        help='Store results under this name in benchmarks/baselines.json.')
+    parser.add_argument('--compare', action='store', default=None,
+                        help='Compare results to the baseline with this name.')
+    args = parser.parse_args()
+    return args
+
+if __name__ == '__main__':
+    args = parse_command_line_arguments()
+    converters = args.converters.split(',')
+    assert all(c in CONVERTERS for c in converters), (
+        "Converters should be of " + ", ".join(CONVERTERS))
+    params = dict(n_cells=args.cells, n_markdown_images=args.markdown_images,
+        image_size=args.image_size, output_size=args.output_size,
+        n_citations=args.citations)
+    results = run_benchmark(converters, args.repeats, params)
+    baselines = load_baselines()
+    baseline = None
+    if args.compare is not None:
+        assert args.compare in baselines, "No baseline " + args.compare
+        assert baselines[args.compare]['params'] == params, (
+            "Baseline {:s} was run with different parameters: {:s}".format(
+                args.compare, str(baselines[args.compare]['params'])))
+        baseline = baselines[args.compare]['results']
+    print_results(results, baseline)
+    if args.save_baseline is not None:
+        baselines[args.save_baseline] = dict(params=params, results=results)
+        with open(BASELINES_FILENAME, 'w') as baselines_file:
+            json.dump(baselines, baselines_file, indent=1, sort_keys=True)
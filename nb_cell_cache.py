@@ -0,0 +1,252 @@
+"""Cache for the markdown of cells rendered to latex.
+
+nbconvert renders every markdown cell with pandoc, one process per cell:
+with the markdown2latex filter, or in newer versions of its latex templates
+with convert_pandoc to pandoc json, resolve_references and convert_pandoc
+to latex. Both filters are replaced by ones that look up the output by hash
+of the input, the formats and the pandoc arguments, so after an edit only
+the changed cells go through pandoc again.
+The cache is kept in memory for the whole process and optionally on disk.
+
+Before exporting, prerender_cells (for markdown2latex) and
+prerender_template_cells (for the templates of nbconvert) fill the cache for
+all markdown cells of a notebook with a single pandoc process per step
+instead of one process per cell.
+"""
+import os
+import re
+import json
+import uuid
+import hashlib
+import subprocess
+from nbconvert.filters import citation2latex, strip_files_prefix
+from nbconvert.utils.pandoc import get_pandoc_version, check_pandoc_version
+from nbconvert.utils.exceptions import ConversionException
+from nbconvert.utils.version import check_version
+from nb_files import write_file_atomically
+try:
+    # newer latex templates render markdown through pandoc json with this filter
+    from nbconvert.filters.filter_links import resolve_references
+except ImportError:
+    resolve_references = None
+
+# Forget everything in memory once there are that many entries
+MAX_MEMORY_ENTRIES = 100000
+# Markdown whose latex depends on the rest of the document, such cells are never
+# batched: footnotes and link definitions (resolved across the document),
+# headers (labels are deduplicated across the document, setext underlines
+# also match horizontal rules), numbered example lists and latex macros
+NOT_BATCHED_REGEX = re.compile(r"\[\^|^ {0,3}\[[^\]]*\]:|^ {0,3}#|^ {0,3}(=+|-+) *$|"
+    r"\(@|\\(re)?newcommand|\\newenvironment|\\def\b", re.MULTILINE)
+# Input format of the markdowncell block of nbconvert's latex templates
+TEMPLATE_MARKDOWN_FORMAT = 'markdown+tex_math_double_backslash'
+
+
+def run_pandoc(source, from_format, to_format, extra_args=None):
+    """Like nbconvert's pandoc, but raises ConversionException if pandoc fails
+    instead of returning its empty output, so failures are never cached.
+    --chapters (removed in pandoc 3) is passed as --top-level-division=chapter
+    to pandoc >= 2."""
+    check_pandoc_version()
+    extra_args = list(extra_args or [])
+    if '--chapters' in extra_args and check_version(str(get_pandoc_version()), '2.0'):
+        extra_args = ['--top-level-division=chapter' if a == '--chapters' else a
+            for a in extra_args]
+    process = subprocess.Popen(['pandoc', '-f', from_format, '-t', to_format] + extra_args,
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    output, error = process.communicate(source.encode('utf8'))
+    if process.returncode != 0:
+        raise ConversionException("pandoc -f {:s} -t {:s} {:s} failed:\n{:s}".format(
+            from_format, to_format, ' '.join(extra_args), error.decode('utf8', 'replace')))
+    return output.decode('utf8', 'replace').rstrip('\n')
+
+
+class MarkdownCache(object):
+    """Pandoc output by hash of (pandoc version, input and output format,
+    extra_args, source)."""
+    def __init__(self, cache_dir=None):
+        self.memory = dict()
+        self.cache_dir = None
+        self.pandoc_version = None
+        if cache_dir is not None:
+            self.use_cache_dir(cache_dir)
+
+    def use_cache_dir(self, cache_dir):
+        """Also store rendered cells in cache_dir, None to only keep them in memory."""
+        if cache_dir is not None and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        self.cache_dir = cache_dir
+
+    def key(self, source, from_format='markdown', to_format='latex', extra_args=None):
+        if self.pandoc_version is None:
+            # pandoc output can change with its version
+            self.pandoc_version = str(get_pandoc_version())
+        key_hash = hashlib.sha1()
+        # None and [] are the same arguments
+        for part in (self.pandoc_version, from_format, to_format,
+                repr(list(extra_args or [])), source):
+            key_hash.update(part.encode('utf8'))
+            key_hash.update(b'\0')
+        return key_hash.hexdigest()
+
+    def get(self, key):
+        """Cached output or None."""
+        if key in self.memory:
+            return self.memory[key]
+        if self.cache_dir is not None:
+            try:
+                with open(os.path.join(self.cache_dir, key + '.out'), 'rb') as cached_file:
+                    output = cached_file.read().decode('utf8')
+                self.remember(key, output)
+                return output
+            except (IOError, OSError):
+                pass
+        return None
+
+    def put(self, key, output):
+        self.remember(key, output)
+        if self.cache_dir is not None:
+            write_file_atomically(os.path.join(self.cache_dir, key + '.out'),
+                output.encode('utf8'))
+
+    def remember(self, key, output):
+        if len(self.memory) >= MAX_MEMORY_ENTRIES:
+            self.memory = dict()
+        self.memory[key] = output
+
+    def convert_pandoc(self, source, from_format, to_format, extra_args=None):
+        """Drop-in replacement for the nbconvert filter."""
+        key = self.key(source, from_format, to_format, extra_args)
+        output = self.get(key)
+        if output is None:
+            output = run_pandoc(source, from_format, to_format, extra_args=extra_args)
+            self.put(key, output)
+        return output
+
+    def markdown2latex(self, source, markup='markdown', extra_args=None):
+        """Drop-in replacement for the nbconvert filter."""
+        return self.convert_pandoc(source, markup, 'latex', extra_args=extra_args)
+
+    def prerender(self, sources, from_format='markdown', to_format='latex', extra_args=None):
+        """Convert all sources not cached yet with one pandoc process.
+        The sources are joined by a separator paragraph which pandoc passes through
+        unchanged, the output is split at the separators again. If the output
+        does not split into one part per source (e.g. a cell with an unclosed
+        code block swallowed a separator), nothing is cached and the filter
+        renders those cells one by one as before.
+        Markdown sources matching NOT_BATCHED_REGEX are left to the filter, so
+        every cell is rendered exactly as if it was rendered alone.
+        Pandoc json sources and outputs are joined and split by their blocks.
+        Returns number of sources rendered."""
+        key_to_source = dict()
+        for source in sources:
+            if from_format != 'json' and NOT_BATCHED_REGEX.search(source) is not None:
+                continue
+            key = self.key(source, from_format, to_format, extra_args)
+            if key not in key_to_source and self.get(key) is None:
+                key_to_source[key] = source
+        if len(key_to_source) < 2:
+            # nothing gained over the filter
+            return 0
+        keys = list(key_to_source.keys())
+        # letters and digits only, so pandoc does not escape it
+        separator = 'nbcellseparator' + uuid.uuid4().hex
+        sources = [key_to_source[key] for key in keys]
+        if from_format == 'json':
+            joined = join_json_documents(sources, separator)
+        else:
+            joined = ('\n\n' + separator + '\n\n').join(sources)
+        output = run_pandoc(joined, from_format, to_format, extra_args=extra_args)
+        if to_format == 'json':
+            parts = split_json_document(output, separator)
+        else:
+            parts = [part.strip('\n') for part in
+                re.split(r'\n*^' + separator + r'$\n*', output, flags=re.MULTILINE)]
+        if len(parts) != len(keys):
+            return 0
+        for key, part in zip(keys, parts):
+            self.put(key, part)
+        return len(keys)
+
+
+def separator_block(separator):
+    """Pandoc json of the separator paragraph."""
+    return {'t': 'Para', 'c': [{'t': 'Str', 'c': separator}]}
+
+def document_blocks(document):
+    """Blocks of a pandoc json document, {"blocks": ...} since pandoc 1.18,
+    [meta, blocks] before."""
+    if isinstance(document, dict):
+        return document['blocks']
+    return document[1]
+
+def with_blocks(document, blocks):
+    if isinstance(document, dict):
+        document = dict(document)
+        document['blocks'] = blocks
+        return document
+    return [document[0], blocks]
+
+def join_json_documents(sources, separator):
+    """One pandoc json document of the blocks of all sources,
+    separated by separator paragraphs. Meta data of the first source is kept."""
+    documents = [json.loads(source) for source in sources]
+    blocks = []
+    for i_document, document in enumerate(documents):
+        if i_document > 0:
+            blocks.append(separator_block(separator))
+        blocks.extend(document_blocks(document))
+    return json.dumps(with_blocks(documents[0], blocks))
+
+def split_json_document(output, separator):
+    """Pandoc json documents of the blocks between separator paragraphs."""
+    document = json.loads(output)
+    parts = [[]]
+    for block in document_blocks(document):
+        if block == separator_block(separator):
+            parts.append([])
+        else:
+            parts[-1].append(block)
+    return [json.dumps(with_blocks(document, blocks), ensure_ascii=False,
+        separators=(',', ':')) for blocks in parts]
+
+
+_markdown_cache = MarkdownCache()
+
+def get_markdown_cache():
+    return _markdown_cache
+
+def install(exporter):
+    """Let exporter render markdown through the cache.
+    Has to be called before the exporter renders anything,
+    since the template looks up its filters when it is compiled.
+    Covers the markdowncell block of old (markdown2latex) and newer
+    (convert_pandoc) nbconvert templates."""
+    exporter.register_filter('markdown2latex', _markdown_cache.markdown2latex)
+    exporter.register_filter('convert_pandoc', _markdown_cache.convert_pandoc)
+
+def prerender_cells(cells, extra_args=None):
+    """Render the markdown cells (of one or several notebooks) with one pandoc
+    process, so the markdown2latex filter finds them all in the cache.
+    extra_args have to be the ones the template passes to markdown2latex.
+    Applies the same filters as the latex templates before markdown2latex."""
+    sources = [strip_files_prefix(citation2latex(cell['source']))
+        for cell in cells if cell['cell_type'] == 'markdown']
+    return _markdown_cache.prerender(sources, extra_args=extra_args)
+
+def prerender_template_cells(cells):
+    """Like prerender_cells, for the markdowncell block of the nbconvert latex
+    templates: the cells go to pandoc json with one pandoc process,
+    through resolve_references, and to latex with another pandoc process.
+    Falls back to prerender_cells for nbconvert versions whose templates
+    still use markdown2latex."""
+    if resolve_references is None:
+        return prerender_cells(cells)
+    sources = [strip_files_prefix(citation2latex(cell['source']))
+        for cell in cells if cell['cell_type'] == 'markdown']
+    sources = [source for source in sources if NOT_BATCHED_REGEX.search(source) is None]
+    _markdown_cache.prerender(sources, TEMPLATE_MARKDOWN_FORMAT, 'json', extra_args=[])
+    documents = [_markdown_cache.get(_markdown_cache.key(source, TEMPLATE_MARKDOWN_FORMAT,
+        'json', extra_args=[])) for source in sources]
+    documents = [resolve_references(document) for document in documents if document is not None]
+    return _markdown_cache.prerender(documents, 'json', 'latex')
@@ -0,0 +1,92 @@
+"""File helpers shared by the converters and their caches."""
+import os
+import shutil
+import hashlib
+import threading
+from multiprocessing.pool import ThreadPool
+
+
+def ensure_directory_exists(directory_name):
+    """Ensure directory exists by creating it if it does not exist.
+    Ignores empty string."""
+    # see http://stackoverflow.com/a/273227/1469195
+    # there is a exotic race condition here, that I couldn't really care less about :P
+    # (if the directory is created (e.g., from another program)
+    # between the if check and the os makedirs,
+    # there will be an error...)
+    if not os.path.exists(directory_name) and not directory_name == '':
+        os.makedirs(directory_name)
+
+def file_content_hash(filename):
+    """sha1 of the file, read in blocks."""
+    content_hash = hashlib.sha1()
+    with open(filename, 'rb') as content_file:
+        for block in iter(lambda: content_file.read(1024 * 1024), b''):
+            content_hash.update(block)
+    return content_hash.hexdigest()
+
+def write_file_atomically(filename, data):
+    """Write to a temporary file first and rename it,
+    so concurrent readers never see half a file."""
+    tmp_filename = filename + '.' + str(os.getpid()) + '.' + str(threading.current_thread().ident)
+    with open(tmp_filename, 'wb') as tmp_file:
+        tmp_file.write(data)
+    os.rename(tmp_filename, filename)
+
+def write_file_if_changed(filename, data):
+    """Write data, unless file already has exactly this content.
+    Replaces the file instead of writing into it, since it may be
+    a hardlink to a source image or a cache file (see link_file_if_changed)."""
+    if os.path.exists(filename) and os.path.getsize(filename) == len(data):
+        with open(filename, 'rb') as existing_file:
+            if existing_file.read() == data:
+                return
+    write_file_atomically(filename, data)
+
+def link_file_if_changed(source_filename, filename, content_hash):
+    """Make filename have the content of source file, unless it already has.
+    Hardlinks if possible, otherwise copies (in the kernel with sendfile if available).
+    Linked files must never be written into, only replaced."""
+    if os.path.exists(filename):
+        if (os.path.samefile(source_filename, filename) or (
+                os.path.getsize(source_filename) == os.path.getsize(filename) and
+                file_content_hash(filename) == content_hash)):
+            return
+        os.remove(filename)
+    try:
+        os.link(source_filename, filename)
+    except (OSError, AttributeError):
+        # other filesystem or no hardlinks supported
+        copy_file(source_filename, filename)
+
+def copy_file(source_filename, filename):
+    """Copy to a temporary file and rename it, so an existing (maybe linked)
+    file is replaced instead of overwritten."""
+    tmp_filename = filename + '.' + str(os.getpid()) + '.' + str(threading.current_thread().ident)
+    if not hasattr(os, 'sendfile'):
+        shutil.copyfile(source_filename, tmp_filename)
+    else:
+        with open(source_filename, 'rb') as source_file, open(tmp_filename, 'wb') as new_file:
+            n_bytes = os.fstat(source_file.fileno()).st_size
+            offset = 0
+            while offset < n_bytes:
+                n_sent = os.sendfile(new_file.fileno(), source_file.fileno(), offset,
+                    n_bytes - offset)
+                if n_sent == 0:
+                    break
+                offset += n_sent
+    os.rename(tmp_filename, filename)
+
+def thread_map(function, items, n_threads):
+    """Map function over items with up to n_threads threads.
+    For downloads, subprocesses and image processing, which do not need the GIL."""
+    if len(items) == 0:
+        return []
+    if n_threads < 2 or len(items) < 2:
+        return [function(item) for item in items]
+    pool = ThreadPool(min(n_threads, len(items)))
+    try:
+        return pool.map(function, items)
+    finally:
+        pool.close()
+        pool.join()
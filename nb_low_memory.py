@@ -0,0 +1,143 @@
+"""Reading notebooks with many or large image outputs in bounded memory.
+
+read_notebook parses the notebook json one cell at a time (with ijson >= 3.1
+if installed, otherwise the json is still loaded at once) and writes png/jpeg
+outputs to the output directory as soon as their cell is read.
+In the notebook, the base64 data is replaced by an empty string and the output
+metadata points to the written file, as nbconvert's ExtractOutputPreprocessor
+would do, so neither the notebook, nor the copy the exporter makes of it,
+nor resources['outputs'] hold the images.
+Exporters used with such notebooks must not extract png/jpeg outputs again,
+see exporter_config.
+"""
+import os
+import json
+import base64
+import hashlib
+import nbformat
+from traitlets.config import Config
+from nb_files import ensure_directory_exists, write_file_if_changed
+try:
+    import ijson
+    from ijson.common import ObjectBuilder
+except ImportError:
+    ijson = None
+try:
+    import resource
+except ImportError:
+    # not available on windows, then no memory limit can be set
+    resource = None
+
+# Outputs written to disk while reading, with file extension
+SPILLED_MIME_TYPES = [('image/png', '.png'), ('image/jpeg', '.jpeg')]
+SCALAR_EVENTS = ('null', 'boolean', 'integer', 'double', 'number', 'string')
+
+
+def read_notebook(notebook_filename, output_dir, output_files_dir, unique_key):
+    """Read notebook, write image outputs to output_dir/output_files_dir.
+    Files are named like ExtractOutputPreprocessor names them and only written
+    if their content changed. Returns notebook and dict of
+    resource key -> (path, content hash) of the written files."""
+    ensure_directory_exists(os.path.join(output_dir, output_files_dir))
+    local_files = dict()
+    cells = []
+    top_level = dict()
+    with open(notebook_filename, 'rb') as notebook_file:
+        for key, value in iter_notebook_items(notebook_file):
+            if key == 'cells':
+                spill_outputs(value, len(cells), output_dir, output_files_dir,
+                    unique_key, local_files)
+                cells.append(value)
+            else:
+                top_level[key] = value
+    if top_level.get('nbformat') != 4:
+        # older notebook format, needs conversion, read again the normal way
+        notebook = nbformat.read(notebook_filename, as_version=4)
+        for cell_index, cell in enumerate(notebook['cells']):
+            spill_outputs(cell, cell_index, output_dir, output_files_dir,
+                unique_key, local_files)
+        return notebook, local_files
+    top_level['cells'] = cells
+    # joins multiline strings, like nbformat.read, but without validation
+    return nbformat.v4.to_notebook(top_level), local_files
+
+def iter_notebook_items(notebook_file):
+    """Yields ('cells', cell) for every cell and (key, value) for the other
+    top level keys of the notebook json. With ijson, only one cell is
+    in memory at a time."""
+    if ijson is None:
+        notebook = json.loads(notebook_file.read().decode('utf8'))
+        cells = notebook.pop('cells', [])
+        # reversed, so every yielded cell can be freed
+        cells.reverse()
+        while len(cells) > 0:
+            yield 'cells', cells.pop()
+        for key, value in notebook.items():
+            yield key, value
+        return
+    builder, path = None, None
+    for prefix, event, value in ijson.parse(notebook_file, use_float=True):
+        if builder is None:
+            if prefix in ('', 'cells'):
+                # the top level object and the cells list themselves
+                continue
+            builder, path = ObjectBuilder(), prefix
+        builder.event(event, value)
+        if prefix == path and event in ('end_map', 'end_array') + SCALAR_EVENTS:
+            if path == 'cells.item':
+                yield 'cells', builder.value
+            else:
+                yield path, builder.value
+            builder, path = None, None
+
+def spill_outputs(cell, cell_index, output_dir, output_files_dir, unique_key, local_files):
+    """Write png/jpeg outputs of cell to files, replace their data by ''."""
+    if cell.get('cell_type') != 'code':
+        return
+    for index, output in enumerate(cell.get('outputs', [])):
+        if output.get('output_type') not in ('display_data', 'execute_result'):
+            continue
+        for mime_type, extension in SPILLED_MIME_TYPES:
+            data = output.get('data', dict()).get(mime_type)
+            if not data:
+                continue
+            if isinstance(data, list):
+                data = ''.join(data)
+            data = base64.b64decode(data.encode('ascii'))
+            key = os.path.join(output_files_dir, '{:s}_{:d}_{:d}{:s}'.format(
+                unique_key, cell_index, index, extension))
+            filename = os.path.join(output_dir, key)
+            write_file_if_changed(filename, data)
+            local_files[key] = (filename, hashlib.sha1(data).hexdigest())
+            output['data'][mime_type] = ''
+            output.setdefault('metadata', dict()).setdefault('filenames', dict())[mime_type] = key
+
+def exporter_config():
+    """Config for exporters of notebooks read with read_notebook,
+    svg and pdf outputs are still extracted by nbconvert."""
+    config = Config()
+    config.ExtractOutputPreprocessor.extract_output_types = set(
+        ['image/svg+xml', 'application/pdf'])
+    return config
+
+def set_memory_limit(megabytes):
+    """Limit the address space of this process (and of processes started
+    from it), allocating beyond raises MemoryError instead of
+    swapping or getting killed."""
+    assert resource is not None, "Memory limit not supported on this platform"
+    limit = int(megabytes * 1024 * 1024)
+    _, hard_limit = resource.getrlimit(resource.RLIMIT_AS)
+    if hard_limit != resource.RLIM_INFINITY:
+        limit = min(limit, hard_limit)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard_limit))
+
+def add_command_line_arguments(parser):
+    """Add --low-memory and --memory-limit to an argparse parser."""
+    parser.add_argument('--low-memory', action='store_true',
+                        help='Read the notebook cell by cell (faster with ijson installed) '
+                        'and write image outputs to disk right away instead of '
+                        'keeping them in memory.')
+    parser.add_argument('--memory-limit', action='store', type=float,
+                        default=None,
+                        help='Maximum address space in megabytes, conversion fails '
+                        'with MemoryError beyond it.')
@@ -0,0 +1,144 @@
+"""Wall time, cpu time and memory of the stages of a conversion.
+
+Usage from code:
+    profiler = nb_profile.Profiler()
+    nb_profile.set_profiler(profiler)
+    nb_to_pdf.convert_notebook(...)
+    profiler.write('profile.json')
+The converters wrap their stages in nb_profile.stage(...), which does nothing
+as long as no profiler is set.
+"""
+import os
+import sys
+import csv
+import json
+import time
+import threading
+from contextlib import contextmanager
+try:
+    import resource
+except ImportError:
+    # not available on windows, then memory is not recorded
+    resource = None
+
+FORMATS = ('json', 'csv', 'chrome')
+CSV_FIELDS = ['notebook', 'stage', 'start', 'wall_seconds', 'cpu_seconds',
+    'process_peak_rss_mb', 'process_peak_rss_increase_mb', 'pid']
+
+
+class Profiler(object):
+    """Records one dict per finished stage.
+    cpu_seconds is the cpu time of the whole process (all its threads) and of
+    the child processes that finished during the stage (pandoc, latex).
+    process_peak_rss_mb is the peak memory of the process so far (not of the
+    stage), at the end of the stage, process_peak_rss_increase_mb how much that
+    peak grew during the stage, 0 if the stage stayed below an earlier peak.
+    callback is called with every record, e.g. to send it elsewhere."""
+    def __init__(self, callback=None):
+        self.records = []
+        self.callback = callback
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name, notebook=None):
+        start_wall = time.time()
+        start_cpu = cpu_seconds()
+        start_rss = process_peak_rss_mb()
+        try:
+            yield
+        finally:
+            end_rss = process_peak_rss_mb()
+            record = dict(notebook=notebook, stage=name, start=start_wall,
+                wall_seconds=time.time() - start_wall,
+                cpu_seconds=cpu_seconds() - start_cpu,
+                process_peak_rss_mb=end_rss,
+                process_peak_rss_increase_mb=None if end_rss is None else end_rss - start_rss,
+                pid=os.getpid(), tid=threading.current_thread().ident)
+            self.add_records([record])
+
+    def add_records(self, records):
+        with self.lock:
+            self.records.extend(records)
+        if self.callback is not None:
+            for record in records:
+                self.callback(record)
+
+    def write(self, filename, file_format=None):
+        """Write records as json, csv or chrome trace (chrome://tracing).
+        Format is guessed from the file extension if not given."""
+        if file_format is None:
+            file_format = 'csv' if filename.endswith('.csv') else 'json'
+        assert file_format in FORMATS, "Format should be one of " + ", ".join(FORMATS)
+        if file_format == 'csv':
+            with open(filename, 'w') as profile_file:
+                writer = csv.DictWriter(profile_file, fieldnames=CSV_FIELDS,
+                    extrasaction='ignore')
+                writer.writeheader()
+                writer.writerows(self.records)
+        elif file_format == 'json':
+            with open(filename, 'w') as profile_file:
+                json.dump(self.records, profile_file, indent=1)
+        else:
+            with open(filename, 'w') as profile_file:
+                json.dump(dict(traceEvents=to_chrome_trace_events(self.records)),
+                    profile_file)
+
+
+def to_chrome_trace_events(records):
+    """Complete events ('X'), timestamps in microseconds."""
+    return [dict(name=r['stage'], cat=r['notebook'] or '', ph='X',
+        ts=int(r['start'] * 1e6), dur=int(r['wall_seconds'] * 1e6),
+        pid=r['pid'], tid=r['tid'],
+        args=dict(cpu_seconds=r['cpu_seconds'],
+            process_peak_rss_mb=r['process_peak_rss_mb'],
+            process_peak_rss_increase_mb=r['process_peak_rss_increase_mb']))
+        for r in records]
+
+def cpu_seconds():
+    """User plus system time of this process and its waited-for children."""
+    times = os.times()
+    return sum(times[:4])
+
+def process_peak_rss_mb():
+    """Peak memory of this process since it started (ru_maxrss)."""
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on mac
+    if sys.platform == 'darwin':
+        return peak_rss / (1024.0 * 1024.0)
+    return peak_rss / 1024.0
+
+
+def add_command_line_arguments(parser):
+    """Add --profile and --profile-format to an argparse parser."""
+    parser.add_argument('--profile', action='store',
+                        default=None,
+                        help='Write time and memory of every conversion stage to this file.')
+    parser.add_argument('--profile-format', action='store',
+                        choices=FORMATS, default=None,
+                        help='Format of the profile file, '
+                        'defaults to csv for .csv files, json otherwise.')
+
+
+_profiler = None
+
+def set_profiler(profiler):
+    """Set the profiler used by stage, None to stop profiling.
+    Returns the previous profiler."""
+    global _profiler
+    previous = _profiler
+    _profiler = profiler
+    return previous
+
+def get_profiler():
+    return _profiler
+
+@contextmanager
+def stage(name, notebook=None):
+    """Record stage with the current profiler, if any."""
+    if _profiler is None:
+        yield
+    else:
+        with _profiler.stage(name, notebook=notebook):
+            yield
@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+"""Conversion server, keeps nbconvert and the exporters loaded in worker processes
+so a conversion only costs the rendering time and not the import time.
+
+Accepts jobs as json posted to http://localhost:<port>/convert, e.g.:
+    {"notebook": "example/notebook/Example_Notebook.ipynb", "format": "pdf",
+     "output_dir": "example/outpdf"}
+Instead of "notebook" (a path), "notebook_json" (the notebook content) together with
+"name" can be posted, then the result is written to output_dir/output_file
+(relative local images can not be resolved in that case).
+Format is one of pdf, latex, html. For pdf and latex, "low_memory": true
+converts huge notebooks with bounded memory, see nb_low_memory.py.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import threading
+import traceback
+import argparse
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+
+FORMATS = ('pdf', 'latex', 'html')
+
+
+def warm_up_worker():
+    """Import nbconvert and create exporters once per worker process."""
+    import nb_to_pdf
+    import nb_to_html
+    nb_to_pdf.get_exporter(nb_to_pdf.PDFExporter)
+    nb_to_pdf.get_exporter(nb_to_pdf.LatexExporter)
+    nb_to_html.get_exporter()
+
+
+def run_job(job):
+    """Run one conversion job (dict as posted) inside a worker process.
+    Returns dict with status and seconds, errors are returned not raised."""
+    import nb_to_pdf
+    import nb_to_html
+    start_time = time.time()
+    tmp_dir = None
+    try:
+        notebook_filename = job.get('notebook')
+        if notebook_filename is None:
+            tmp_dir = tempfile.mkdtemp(prefix='nb_server')
+            notebook_filename = os.path.join(tmp_dir, job['name'] + '.ipynb')
+            with open(notebook_filename, 'w') as notebook_file:
+                json.dump(job['notebook_json'], notebook_file)
+        converted = True
+        if job['format'] == 'html':
+            output_file = job.get('output_file')
+            if output_file is None:
+                output_dir = nb_to_pdf.determine_output_dir(
+                    job.get('notebook', ''), job.get('output_dir'))
+                output_file = os.path.join(output_dir,
+                    nb_to_pdf.to_notebook_basename(notebook_filename) + '.html')
+            nb_to_html.convert_notebook(notebook_filename, output_file)
+        else:
+            if job['format'] == 'pdf':
+                exporter_class = nb_to_pdf.PDFExporter
+            else:
+                exporter_class = nb_to_pdf.LatexExporter
+            output_dir = job.get('output_dir')
+            if output_dir is None and tmp_dir is not None:
+                output_dir = '.'
+            converted = nb_to_pdf.convert_notebook(notebook_filename,
+                output_dir=output_dir, exporter_class=exporter_class,
+                use_cache=job.get('use_cache', True),
+                low_memory=job.get('low_memory', False))
+        return dict(status='ok', converted=converted,
+            seconds=time.time() - start_time)
+    except Exception:
+        return dict(status='error', error=traceback.format_exc(),
+            seconds=time.time() - start_time)
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+class ConversionServer(ThreadingMixIn, HTTPServer):
+    """Http server handing jobs to a pool of warm worker processes.
+    At most n_workers jobs run at once, at most max_queued wait,
+    further jobs are rejected.
+    job_function runs the jobs in the workers (run_job, replaced in tests)."""
+    daemon_threads = True
+
+    def __init__(self, address, n_workers, max_queued, job_timeout, job_function=run_job):
+        HTTPServer.__init__(self, address, ConversionRequestHandler)
+        self.n_workers = n_workers
+        self.max_queued = max_queued
+        self.job_timeout = job_timeout
+        self.job_function = job_function
+        self.executor_lock = threading.Lock()
+        self.executor = self.create_executor()
+        # counts running plus waiting jobs
+        self.job_slots = threading.Semaphore(n_workers + max_queued)
+        self.n_jobs_lock = threading.Lock()
+        self.n_jobs = 0
+
+    def create_executor(self):
+        return ProcessPoolExecutor(max_workers=self.n_workers, initializer=warm_up_worker)
+
+    def submit(self, job):
+        """Run job in the pool and wait for result.
+        Returns None if the queue is full. The job keeps its slot until it
+        finished in the worker, also if waiting for it timed out."""
+        if not self.job_slots.acquire(False):
+            return None
+        with self.n_jobs_lock:
+            self.n_jobs += 1
+        try:
+            future = self.submit_to_executor(job)
+        except Exception:
+            self.release_job_slot(None)
+            raise
+        # also runs if the job raised or its worker process died
+        future.add_done_callback(self.release_job_slot)
+        try:
+            return future.result(self.job_timeout)
+        except TimeoutError:
+            return dict(status='error', error='Timeout after {:.1f}s, job is still '
+                'running'.format(self.job_timeout))
+        except BrokenProcessPool:
+            return dict(status='error', error='Worker process died during the job')
+        except Exception:
+            return dict(status='error', error=traceback.format_exc())
+
+    def submit_to_executor(self, job):
+        """Submit job, replacing the pool if a worker died before.
+        Once a worker died, all its jobs fail and the pool takes no new ones."""
+        executor = self.executor
+        try:
+            return executor.submit(self.job_function, job)
+        except BrokenProcessPool:
+            with self.executor_lock:
+                if self.executor is executor:
+                    self.executor = self.create_executor()
+                    executor.shutdown(wait=False)
+                executor = self.executor
+            return executor.submit(self.job_function, job)
+
+    def release_job_slot(self, future):
+        with self.n_jobs_lock:
+            self.n_jobs -= 1
+        self.job_slots.release()
+
+    def server_close(self):
+        HTTPServer.server_close(self)
+        # stop running jobs instead of waiting for them
+        with self.executor_lock:
+            for process in list((self.executor._processes or dict()).values()):
+                process.terminate()
+            self.executor.shutdown(wait=True)
+
+
+class ConversionRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/status':
+            self.send_json(404, dict(status='error', error='Unknown path ' + self.path))
+            return
+        with self.server.n_jobs_lock:
+            n_jobs = self.server.n_jobs
+        self.send_json(200, dict(status='ok', jobs=n_jobs,
+            workers=self.server.n_workers, max_queued=self.server.max_queued))
+
+    def do_POST(self):
+        if self.path != '/convert':
+            self.send_json(404, dict(status='error', error='Unknown path ' + self.path))
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            job = json.loads(self.rfile.read(length).decode('utf8'))
+        except ValueError as e:
+            self.send_json(400, dict(status='error', error='Invalid json: ' + str(e)))
+            return
+        error = check_job(job)
+        if error is not None:
+            self.send_json(400, dict(status='error', error=error))
+            return
+        result = self.server.submit(job)
+        if result is None:
+            self.send_json(503, dict(status='error', error='Job queue is full'))
+        elif result['status'] == 'ok':
+            self.send_json(200, result)
+        else:
+            self.send_json(500, result)
+
+    def send_json(self, code, content):
+        body = json.dumps(content).encode('utf8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def check_job(job):
+    """Returns error message for invalid job, None if job is valid."""
+    if not isinstance(job, dict):
+        return 'Job should be a json object'
+    if job.get('format') not in FORMATS:
+        return 'Format should be one of ' + ', '.join(FORMATS)
+    if 'notebook' in job:
+        if not os.path.exists(job['notebook']):
+            return 'Notebook {:s} does not exist'.format(job['notebook'])
+    elif 'notebook_json' in job:
+        if 'name' not in job:
+            return 'Name needed for notebook_json'
+        if os.path.basename(job['name']) != job['name']:
+            return 'Name should not contain a directory'
+    else:
+        return 'Either notebook or notebook_json needed'
+    return None
+
+
+def parse_command_line_arguments():
+    parser = argparse.ArgumentParser(
+        description="""Run a local server converting notebooks to pdf, latex or html.
+        Example: ./nb_server.py --port 8765 --workers 4"""
+    )
+    parser.add_argument('--host', action='store', default='127.0.0.1',
+                        help='Address to listen on, defaults to localhost only.')
+    parser.add_argument('--port', action='store', type=int, default=8765,
+                        help='Port to listen on.')
+    parser.add_argument('--workers', action='store', type=int, default=2,
+                        help='Number of conversions running at the same time.')
+    parser.add_argument('--max-queued', action='store', type=int, default=16,
+                        help='Number of jobs that may wait for a worker, further jobs are rejected.')
+    parser.add_argument('--timeout', action='store', type=float, default=600,
+                        help='Seconds after which a waiting request gives up.')
+    args = parser.parse_args()
+    return args
+
+if __name__ == '__main__':
+    args = parse_command_line_arguments()
+    server = ConversionServer((args.host, args.port), n_workers=args.workers,
+        max_queued=args.max_queued, job_timeout=args.timeout)
+    print("Serving on http://{:s}:{:d}/convert".format(args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    sys.exit(0)
@@ -0,0 +1,208 @@
+"""Shrinking what is passed to latex: dropping unwanted outputs and
+downscaling raster images to the resolution they are printed at.
+
+All images are drawn with \\adjustimage{max size={0.9\\linewidth}{0.9\\paperheight}},
+at their natural size (pixels / embedded dpi, 72 dpi if none) or smaller if
+that does not fit the box. More pixels than the drawn size holds at the target
+dpi only make latex slower and the pdf larger. Downscaled images are saved
+with their dpi scaled by the same factor, so their natural size and
+the size they are drawn at do not change.
+JPEG images are only downscaled if asked for, since they have to be
+compressed again lossily.
+"""
+import os
+import io
+import base64
+import argparse
+import hashlib
+from nb_files import write_file_atomically, thread_map
+try:
+    from PIL import Image
+except ImportError:
+    try:
+        import Image
+    except ImportError:
+        # no downscaling without PIL/Pillow
+        Image = None
+
+DEFAULT_DPI = 300
+# Article class on letter paper, 345pt text width
+LINEWIDTH_INCHES = 345 / 72.27
+PAPERHEIGHT_INCHES = 11.0
+MAX_SIZE_FRACTION = 0.9
+RASTER_FORMATS = {'.png': 'PNG', '.jpg': 'JPEG', '.jpeg': 'JPEG'}
+OUTPUT_MIME_TYPES = {'image/png': '.png', 'image/jpeg': '.jpeg'}
+JPEG_QUALITY = 90
+# What latex assumes for images without dpi
+DEFAULT_IMAGE_DPI = 72.0
+
+
+def strip_outputs(outputs, drop_mime_types):
+    """Outputs without those having data of any of drop_mime_types."""
+    if len(drop_mime_types) == 0:
+        return outputs
+    drop_mime_types = set(drop_mime_types)
+    return [o for o in outputs
+        if drop_mime_types.isdisjoint(o.get('data', ()))]
+
+
+class ImageShrinker(object):
+    """Downscales raster images with more pixels than the size they are drawn
+    at holds at dpi, n_threads in parallel. JPEG images only with shrink_jpeg.
+    Downscaled images are cached in cache_dir if given, named by hash of
+    the original and settings_key."""
+    def __init__(self, dpi=DEFAULT_DPI, cache_dir=None, n_threads=8,
+            linewidth_inches=LINEWIDTH_INCHES, paperheight_inches=PAPERHEIGHT_INCHES,
+            shrink_jpeg=False):
+        assert Image is not None, "Downscaling images needs PIL or Pillow"
+        assert dpi > 0, "Dpi should be positive"
+        self.dpi = dpi
+        self.max_width_inches = MAX_SIZE_FRACTION * linewidth_inches
+        self.max_height_inches = MAX_SIZE_FRACTION * paperheight_inches
+        self.shrink_jpeg = shrink_jpeg
+        # everything the downscaled data depends on besides the original
+        self.settings_key = '{:g}dpi_{:.3f}x{:.3f}in'.format(dpi,
+            self.max_width_inches, self.max_height_inches)
+        self.cache_dir = cache_dir
+        self.n_threads = n_threads
+        if cache_dir is not None and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+    def _cache_filename(self, content_hash, extension):
+        return os.path.join(self.cache_dir, '{:s}_{:s}{:s}'.format(
+            content_hash, self.settings_key, extension))
+
+    def target_size(self, size, image_dpi=None):
+        """Size and dpi of the downscaled image, None if it has no more
+        pixels than needed. image_dpi is the (x, y) dpi embedded in the image."""
+        width, height = size
+        dpi_x, dpi_y = image_dpi or (DEFAULT_IMAGE_DPI, DEFAULT_IMAGE_DPI)
+        if dpi_x <= 0 or dpi_y <= 0:
+            dpi_x, dpi_y = DEFAULT_IMAGE_DPI, DEFAULT_IMAGE_DPI
+        # drawn at natural size, or smaller if that does not fit the box
+        fit = min(1.0, self.max_width_inches / (width / float(dpi_x)),
+            self.max_height_inches / (height / float(dpi_y)))
+        scale = min(fit * self.dpi / float(dpi_x), fit * self.dpi / float(dpi_y))
+        if scale >= 1:
+            return None
+        new_size = max(1, int(round(width * scale))), max(1, int(round(height * scale)))
+        # scaled by the factor actually used, so the natural size stays the same
+        new_dpi = dpi_x * new_size[0] / float(width), dpi_y * new_size[1] / float(height)
+        return new_size, new_dpi
+
+    def shrink(self, img_file, extension, content_hash):
+        """Downscaled image data of the image in img_file (filename or file object),
+        None if it already fits, is no raster image or can not be read.
+        Only the image header is read if the image fits."""
+        img_format = RASTER_FORMATS.get(extension.lower())
+        if img_format is None or (img_format == 'JPEG' and not self.shrink_jpeg):
+            return None
+        if self.cache_dir is not None:
+            try:
+                with open(self._cache_filename(content_hash, extension), 'rb') as cached_file:
+                    return cached_file.read()
+            except (IOError, OSError):
+                pass
+        try:
+            img = Image.open(img_file)
+            target = self.target_size(img.size, img.info.get('dpi'))
+            if target is None:
+                return None
+            new_size, new_dpi = target
+            if img.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+                # resampling palette images would not interpolate
+                img = img.convert('RGBA' if 'transparency' in img.info else 'RGB')
+            # ANTIALIAS in old PIL versions
+            img = img.resize(new_size, getattr(Image, 'LANCZOS', None) or Image.ANTIALIAS)
+            shrunk_file = io.BytesIO()
+            if img_format == 'JPEG':
+                if img.mode not in ('RGB', 'L'):
+                    img = img.convert('RGB')
+                img.save(shrunk_file, format='JPEG', quality=JPEG_QUALITY, optimize=True,
+                    dpi=new_dpi)
+            else:
+                img.save(shrunk_file, format='PNG', optimize=True, dpi=new_dpi)
+        except (IOError, OSError, ValueError):
+            # leave unreadable images to latex
+            return None
+        shrunk_data = shrunk_file.getvalue()
+        if self.cache_dir is not None:
+            self.store(content_hash, extension, shrunk_data)
+        return shrunk_data
+
+    def store(self, content_hash, extension, shrunk_data):
+        write_file_atomically(self._cache_filename(content_hash, extension), shrunk_data)
+
+    def map(self, function, items):
+        # PIL releases the GIL while decoding, resizing and encoding
+        return thread_map(function, items, self.n_threads)
+
+    def shrink_outputs(self, outputs):
+        """Shrink image data of a dict resource key -> data in place."""
+        keys = [k for k in outputs if os.path.splitext(k)[1].lower() in RASTER_FORMATS]
+        shrunk = self.map(lambda key: self.shrink(io.BytesIO(outputs[key]),
+            os.path.splitext(key)[1], hashlib.sha1(outputs[key]).hexdigest()), keys)
+        for key, shrunk_data in zip(keys, shrunk):
+            if shrunk_data is not None and len(shrunk_data) < len(outputs[key]):
+                outputs[key] = shrunk_data
+
+    def shrink_cell_outputs(self, cells):
+        """Shrink base64 png/jpeg outputs of code cells in place."""
+        found = []
+        for cell in cells:
+            for output in cell.get('outputs', []):
+                for mime_type, extension in OUTPUT_MIME_TYPES.items():
+                    if output.get('data', dict()).get(mime_type):
+                        found.append((output['data'], mime_type, extension))
+
+        def shrink_output(item):
+            data, mime_type, extension = item
+            img_data = base64.b64decode(data[mime_type].encode('ascii'))
+            shrunk_data = self.shrink(io.BytesIO(img_data), extension,
+                hashlib.sha1(img_data).hexdigest())
+            if shrunk_data is not None and len(shrunk_data) < len(img_data):
+                data[mime_type] = base64.b64encode(shrunk_data).decode('ascii')
+        self.map(shrink_output, found)
+
+    def shrink_local_files(self, resources):
+        """Shrink images of resources['local_files'] (resource key -> (path, content hash)).
+        With a cache dir, the entry then points to the cached downscaled file,
+        otherwise the downscaled data is moved to resources['outputs']."""
+        local_files = resources.get('local_files', dict())
+        keys = [k for k in local_files if os.path.splitext(k)[1].lower() in RASTER_FORMATS]
+        shrunk = self.map(lambda key: self.shrink(local_files[key][0],
+            os.path.splitext(key)[1], local_files[key][1]), keys)
+        for key, shrunk_data in zip(keys, shrunk):
+            path, content_hash = local_files[key]
+            if shrunk_data is None or len(shrunk_data) >= os.path.getsize(path):
+                continue
+            extension = os.path.splitext(key)[1]
+            if self.cache_dir is not None:
+                local_files[key] = (self._cache_filename(content_hash, extension),
+                    hashlib.sha1(shrunk_data).hexdigest())
+            else:
+                del local_files[key]
+                resources['outputs'][key] = shrunk_data
+
+
+def image_dpi(value):
+    """Argparse type of --image-dpi, 0 or a positive number."""
+    dpi = float(value)
+    if dpi < 0:
+        raise argparse.ArgumentTypeError("should be 0 or positive, got " + value)
+    return dpi
+
+def add_command_line_arguments(parser, drop_output_types=()):
+    """Add --image-dpi, --shrink-jpeg and --drop-output-types to an argparse parser.
+    Images are only downscaled if --image-dpi is given (needs PIL or Pillow)."""
+    parser.add_argument('--image-dpi', action='store', type=image_dpi, default=0,
+                        help='Downscale raster images to this resolution at the size they are '
+                        'printed at (e.g. {:d}, needs PIL or Pillow), '
+                        'by default they are kept as they are.'.format(DEFAULT_DPI))
+    parser.add_argument('--shrink-jpeg', action='store_true',
+                        help='Also downscale JPEG images, they are then compressed '
+                        'again (lossy, quality {:d}).'.format(JPEG_QUALITY))
+    parser.add_argument('--drop-output-types', action='store', nargs='*',
+                        default=list(drop_output_types),
+                        help='Remove outputs having one of these MIME types, '
+                        'defaults to ' + (' '.join(drop_output_types) or 'none') + '.')
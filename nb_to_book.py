@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+"""Build one latex document (book/thesis) from many notebooks.
+Every notebook is converted to a chapter with nb_to_tex.py, chapters are
+rendered in parallel and only if their notebook changed. Images of all chapters
+are stored once in a shared directory, named by their content hash."""
+import os
+import sys
+import re
+import json
+import hashlib
+import argparse
+import traceback
+from multiprocessing import Pool
+import nbformat
+from jinja2 import DictLoader
+from nbconvert.exporters import LatexExporter
+import nb_to_tex
+import nb_cell_cache
+import nb_shrink
+
+# Header of nbconvert's latex template with the ipython cell style, so the book
+# has the packages and the pandoc and pygments definitions (tightlist, longtable,
+# Shaded, KeywordTok, ...) the chapters were rendered for. Report class, no title
+PREAMBLE_TEMPLATE = """
+    ((*- extends 'style_ipython.tplx' -*))
+    ((* block docclass *))
+    \\documentclass{report}
+    ((* endblock docclass *))
+    ((* block title *))((* endblock title *))
+    ((* block body *))((* endblock body *))
+    """
+# For the html replacements of nb_to_tex.py
+EXTRA_PREAMBLE = r"""\usepackage{comment}
+\newenvironment{keypointbox}{\begin{quote}}{\end{quote}}
+"""
+
+
+def render_default_preamble():
+    """Preamble from nbconvert's latex header and EXTRA_PREAMBLE."""
+    dl = DictLoader({'book_preamble.tplx': PREAMBLE_TEMPLATE})
+    exporter = LatexExporter(extra_loaders=[dl])
+    exporter.template_file = 'book_preamble.tplx'
+    preamble, _ = exporter.from_notebook_node(nbformat.v4.new_notebook())
+    return preamble.strip() + '\n' + EXTRA_PREAMBLE
+
+def build_book(manifest_filename, output_dir, bibtex_filename=None, preamble=None,
+        cache_dir=None, offline=False, n_jobs=1, n_threads=8, image_dpi=None,
+        shrink_jpeg=False, drop_output_types=nb_to_tex.DROPPED_OUTPUT_TYPES):
+    """Render changed chapters of the notebooks listed in the manifest
+    and write the master .tex file including all chapters.
+    Preamble defaults to render_default_preamble().
+    With image_dpi, raster images are downscaled to that resolution
+    at the size they are printed at (JPEG images only with shrink_jpeg).
+    Returns list of (notebook_filename, error or None) of rendered chapters."""
+    notebook_filenames = read_manifest(manifest_filename)
+    book_name = os.path.splitext(os.path.basename(manifest_filename))[0]
+    chapter_names = [os.path.basename(f).replace('.ipynb', '')
+        for f in notebook_filenames]
+    duplicates = set(n for n in chapter_names if chapter_names.count(n) > 1)
+    assert len(duplicates) == 0, (
+        "Notebook names must be unique, got duplicates: " + ", ".join(sorted(duplicates)))
+    chapter_dir = os.path.join(output_dir, 'chapters')
+    files_dir_name = '%s_files' % book_name
+    nb_to_tex.ensure_directory_exists(chapter_dir)
+    nb_to_tex.ensure_directory_exists(os.path.join(output_dir, files_dir_name))
+
+    state_filename = os.path.join(output_dir, '.%s.buildstate.json' % book_name)
+    state = dict()
+    if os.path.exists(state_filename):
+        with open(state_filename, 'r') as state_file:
+            state = json.load(state_file)
+    chapter_hashes = [compute_chapter_hash(f, bibtex_filename, image_dpi, drop_output_types,
+        shrink_jpeg) for f in notebook_filenames]
+    job_args = [(f, bibtex_filename, cache_dir, offline, n_threads, image_dpi, shrink_jpeg,
+        drop_output_types)
+        for f, name, chapter_hash in zip(notebook_filenames, chapter_names, chapter_hashes)
+        if state.get(name) != chapter_hash or not os.path.exists(
+            os.path.join(chapter_dir, name + '.tex'))]
+    if n_jobs == 1 or len(job_args) < 2:
+        results = [render_chapter(args) for args in job_args]
+    else:
+        pool = Pool(processes=n_jobs)
+        try:
+            results = pool.map(render_chapter, job_args, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    name_to_hash = dict(zip(chapter_names, chapter_hashes))
+    for notebook_filename, body, outputs, error in results:
+        name = os.path.basename(notebook_filename).replace('.ipynb', '')
+        if error is not None:
+            state.pop(name, None)
+            continue
+        body = write_shared_resources(body, outputs, output_dir, files_dir_name)
+        with open(os.path.join(chapter_dir, name + '.tex'), 'wb') as chapter_file:
+            chapter_file.write(body.encode('utf8'))
+        state[name] = name_to_hash[name]
+    with open(state_filename, 'w') as state_file:
+        json.dump(state, state_file)
+
+    if preamble is None:
+        preamble = render_default_preamble()
+    write_master_tex(os.path.join(output_dir, book_name + '.tex'), chapter_names,
+        preamble, bibtex_filename)
+    return [(r[0], r[3]) for r in results]
+
+def read_manifest(manifest_filename):
+    """Notebook filenames, one per line, relative to the manifest.
+    Empty lines and lines starting with # are ignored."""
+    manifest_dir = os.path.dirname(manifest_filename)
+    with open(manifest_filename, 'r') as manifest_file:
+        lines = [l.strip() for l in manifest_file]
+    return [os.path.join(manifest_dir, l) for l in lines
+        if l != '' and not l.startswith('#')]
+
+def compute_chapter_hash(notebook_filename, bibtex_filename, image_dpi=None,
+        drop_output_types=(), shrink_jpeg=False):
+    """Chapter has to be rendered again if notebook, bibtex, template
+    or image resolution and dropped output types changed.
+    Remote images are not checked, those are revalidated by the image cache
+    whenever a chapter is rendered."""
+    chapter_hash = hashlib.sha1()
+    chapter_hash.update(nb_to_tex.ARTICLE_TEMPLATE.encode('utf8'))
+    chapter_hash.update('{!r} {!r} {:s}'.format(image_dpi, shrink_jpeg,
+        ' '.join(sorted(drop_output_types))).encode('utf8'))
+    with open(notebook_filename, 'rb') as notebook_file:
+        chapter_hash.update(notebook_file.read())
+    if bibtex_filename is not None:
+        stat = os.stat(bibtex_filename)
+        chapter_hash.update('{:f} {:d}'.format(stat.st_mtime, stat.st_size).encode('utf8'))
+    return chapter_hash.hexdigest()
+
+def render_chapter(args):
+    """Convert one notebook to a chapter body, in a worker process.
+    Returns notebook filename, body, outputs, error (None if successful)."""
+    (notebook_filename, bibtex_filename, cache_dir, offline, n_threads, image_dpi,
+        shrink_jpeg, drop_output_types) = args
+    image_cache, conversion_cache, bibtex_cache, image_shrinker = None, None, None, None
+    if image_dpi is not None:
+        image_shrinker = nb_shrink.ImageShrinker(image_dpi, n_threads=n_threads,
+            cache_dir=None if cache_dir is None else os.path.join(cache_dir, 'shrunk'),
+            shrink_jpeg=shrink_jpeg)
+    if cache_dir is not None:
+        image_cache = nb_to_tex.ImageCache(os.path.join(cache_dir, 'images'))
+        conversion_cache = nb_to_tex.ConversionCache(os.path.join(cache_dir, 'conversions'))
+        bibtex_cache = nb_to_tex.BibtexIndexCache(os.path.join(cache_dir, 'bibtex'))
+        nb_cell_cache.get_markdown_cache().use_cache_dir(os.path.join(cache_dir, 'cells'))
+    try:
+        body, resources = nb_to_tex.convert_to_body_resources(notebook_filename,
+            bibtex_filename, image_cache=image_cache, conversion_cache=conversion_cache,
+            bibtex_cache=bibtex_cache, offline=offline, n_threads=n_threads,
+            image_shrinker=image_shrinker, drop_output_types=drop_output_types)
+    except Exception:
+        return notebook_filename, None, None, traceback.format_exc()
+    return notebook_filename, body, resources['outputs'], None
+
+def write_shared_resources(body, outputs, output_dir, files_dir_name):
+    """Write outputs into the shared files dir, named by content hash,
+    so images used by several chapters are stored once.
+    Returns body with references to the shared files."""
+    key_to_shared = dict()
+    for key, data in outputs.items():
+        if key.endswith('svg'):
+            # converted to pdf by nbconvert, pdf is used in latex
+            continue
+        extension = os.path.splitext(key)[1]
+        shared_name = files_dir_name + '/' + hashlib.sha1(data).hexdigest()[:16] + extension
+        shared_filename = os.path.join(output_dir, shared_name)
+        if not os.path.exists(shared_filename):
+            with open(shared_filename, 'wb') as shared_file:
+                shared_file.write(data)
+        key_to_shared[key.replace(os.path.sep, '/')] = shared_name
+    if len(key_to_shared) == 0:
+        return body
+    # one rule for all filenames, longest first, in case one is a prefix of another
+    keys_regex = '|'.join(re.escape(key)
+        for key in sorted(key_to_shared, key=len, reverse=True))
+    rewriter = nb_to_tex.CellRewriter([(keys_regex,
+        lambda match: key_to_shared[match.group(0)])])
+    return rewriter.rewrite(body)
+
+def write_master_tex(master_filename, chapter_names, preamble, bibtex_filename):
+    lines = [preamble, '\\begin{document}', '']
+    lines.extend('\\input{chapters/%s}' % name for name in chapter_names)
+    if bibtex_filename is not None:
+        bibtex_name = os.path.splitext(os.path.basename(bibtex_filename))[0]
+        lines.extend(['', '\\bibliographystyle{plain}', '\\bibliography{%s}' % bibtex_name])
+    lines.extend(['', '\\end{document}', ''])
+    with open(master_filename, 'w') as master_file:
+        master_file.write('\n'.join(lines))
+
+
+def parse_command_line_arguments():
+    parser = argparse.ArgumentParser(
+        description="""Build a latex book from the notebooks listed in a manifest file
+        (one notebook per line, in chapter order).
+        Example: ./nb_to_book.py thesis.txt --outdir thesis/ --bibtex thesis.bib --jobs 4"""
+    )
+    parser.add_argument('manifest_file_name', action='store',
+                        help='File listing the notebooks, one per line')
+    parser.add_argument('--outdir', action='store', required=True,
+                        help='Directory to write master .tex, chapters and images to.')
+    parser.add_argument('--bibtex', action='store', default=None,
+                        help='Bibtex file to look up cite2c citations.')
+    parser.add_argument('--preamble', action='store', default=None,
+                        help='File with latex preamble (documentclass, packages) '
+                        'to use instead of the default one.')
+    parser.add_argument('--cache-dir', action='store',
+                        default=os.path.join(os.path.expanduser('~'), '.cache', 'nb_to_tex'),
+                        help='Directory to cache downloaded, converted and downscaled images, '
+                        'the bibtex index and rendered markdown cells in.')
+    parser.add_argument('--offline', action='store_true',
+                        help='Do not download images, only use cached ones.')
+    parser.add_argument('--jobs', action='store', type=int, default=1,
+                        help='Number of chapters rendered in parallel.')
+    parser.add_argument('--threads', action='store', type=int, default=8,
+                        help='Number of images downloaded or converted in parallel per chapter.')
+    nb_shrink.add_command_line_arguments(parser, nb_to_tex.DROPPED_OUTPUT_TYPES)
+    args = parser.parse_args()
+    return args
+
+if __name__ == '__main__':
+    args = parse_command_line_arguments()
+    preamble = None
+    if args.preamble is not None:
+        with open(args.preamble, 'r') as preamble_file:
+            preamble = preamble_file.read()
+    results = build_book(args.manifest_file_name, args.outdir,
+        bibtex_filename=args.bibtex, preamble=preamble, cache_dir=args.cache_dir,
+        offline=args.offline, n_jobs=args.jobs, n_threads=args.threads,
+        image_dpi=args.image_dpi if args.image_dpi > 0 else None,
+        shrink_jpeg=args.shrink_jpeg, drop_output_types=args.drop_output_types)
+    for notebook_filename, error in results:
+        if error is None:
+            print("Rendered " + notebook_filename)
+        else:
+            print("Error rendering {:s}:\n{:s}".format(notebook_filename, error))
+    print("{:d} chapters rendered, others unchanged.".format(len(results)))
+    if any(error is not None for _, error in results):
+        sys.exit(1)
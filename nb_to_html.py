@@ -1,35 +1,132 @@
 #!/usr/bin/env python
 
 import os
+import io
 import base64
-import sys
+import shutil
+import tempfile
 import re
+import argparse
 from nbconvert import HTMLExporter
+import nb_profile
+import nb_watch
 
+# Finds the filename in <img src="..."> tags, skips data urls
+# (outputs nbconvert already inlined) and remote images
+IMG_REGEX = r"(?<=img src=\")(?!data:|https?:|//)[^\"]*"
 
-if __name__ == '__main__':
-    assert len(sys.argv) == 3, \
-        './convert_nb_to_html.py [notebook filename] [html output filename]'
-    input_file = sys.argv[1]
-    output_file = sys.argv[2]
+# Exporter reused for all notebooks converted in this process
+_html_exporter = None
+
+def get_exporter():
+    """Html exporter, created only once per process."""
+    global _html_exporter
+    if _html_exporter is None:
+        _html_exporter = HTMLExporter()
+    return _html_exporter
+
+def convert_notebook(notebook_filename, output_filename):
+    """Convert notebook to a single html file with images inlined.
+    Returns paths of the inlined images."""
+    with nb_profile.stage('export', notebook_filename):
+        body, resources = get_exporter().from_filename(notebook_filename)
+    base_dir = os.path.dirname(os.path.abspath(notebook_filename))
+    # written next to the output and renamed, so a failure (e.g. a missing
+    # image) never leaves a truncated html file behind
+    tmp_filename = output_filename + '.' + str(os.getpid()) + '.tmp'
+    with nb_profile.stage('write', notebook_filename):
+        try:
+            with io.open(tmp_filename, 'w', encoding='utf8') as out_file:
+                inlined = write_inlined_html(body, out_file, base_dir)
+            os.rename(tmp_filename, output_filename)
+        finally:
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+    return inlined
+
+def write_inlined_html(body, out_file, base_dir):
+    """Write html body to file, replace image files by base64 data.
+    Writes piece by piece instead of building a new copy of the body,
+    every image file is only encoded once. Returns paths of the images."""
+    encoder = Base64ImageEncoder()
+    try:
+        position = 0
+        for match in re.finditer(IMG_REGEX, body):
+            out_file.write(body[position:match.start()])
+            encoder.write(os.path.join(base_dir, match.group(0)), out_file)
+            position = match.end()
+        out_file.write(body[position:])
+        return list(encoder.encoded_files.keys())
+    finally:
+        encoder.close()
 
-    base_dir = os.path.dirname(os.path.abspath(input_file))
 
-    def to_base64(match):
-        full_path = os.path.join(base_dir, match.group(0))
-        print('Replacing ' + full_path)
+class Base64ImageEncoder(object):
+    """Writes images as base64 data urls in chunks, so large images are never
+    completely in memory. Encoded images are kept in temporary files,
+    repeated images are copied from there instead of encoded again."""
+    # multiple of 3, so chunks can be encoded independently
+    chunk_size = 3 * 256 * 1024
 
-        with open(full_path, 'rb') as img:
-            enc = base64.b64encode(img.read()).decode()
+    def __init__(self):
+        self.tmp_dir = None
+        self.encoded_files = dict()
+
+    def write(self, full_path, out_file):
+        if full_path not in self.encoded_files:
+            print('Replacing ' + full_path)
+            if self.tmp_dir is None:
+                self.tmp_dir = tempfile.mkdtemp(prefix='nb_to_html')
+            encoded_filename = os.path.join(self.tmp_dir,
+                str(len(self.encoded_files)) + '.b64')
             ext = os.path.splitext(full_path)[1]
+            with open(full_path, 'rb') as img, \
+                    io.open(encoded_filename, 'w', encoding='ascii') as encoded_file:
+                encoded_file.write(u'data:image/' + ext[1:] + u';base64,')
+                for chunk in iter(lambda: img.read(self.chunk_size), b''):
+                    encoded_file.write(base64.b64encode(chunk).decode())
+            self.encoded_files[full_path] = encoded_filename
+        with io.open(self.encoded_files[full_path], 'r', encoding='ascii') as encoded_file:
+            shutil.copyfileobj(encoded_file, out_file, self.chunk_size)
+
+    def close(self):
+        if self.tmp_dir is not None:
+            shutil.rmtree(self.tmp_dir, ignore_errors=True)
+            self.tmp_dir = None
 
-        return 'data:image/' + ext[1:] + ';base64,' + enc
 
-    html_exporter = HTMLExporter()
-    body, resources = html_exporter.from_filename(input_file)
+def parse_command_line_arguments():
+    parser = argparse.ArgumentParser(
+        description="""Convert notebook to a single html file, images are inlined.
+        Example: ./nb_to_html.py notebooks/Example_Notebook.ipynb out/Example_Notebook.html"""
+    )
+    parser.add_argument('notebook_file_name', action='store',
+                        help='File name of notebook to convert')
+    parser.add_argument('output_file_name', action='store',
+                        help='File name of html output')
+    parser.add_argument('--watch', action='store_true',
+                        help='Keep running and convert again whenever the notebook '
+                        'or one of its images changes.')
+    nb_profile.add_command_line_arguments(parser)
+    args = parser.parse_args()
+    return args
 
-    img_regex = r"(?<=img src=\")[^\"]*"
-    body = re.sub(img_regex, to_base64, body)
+if __name__ == '__main__':
+    args = parse_command_line_arguments()
+    if args.profile is not None:
+        nb_profile.set_profiler(nb_profile.Profiler())
+    if args.watch:
+        image_paths = []
 
-    with open(output_file, 'w') as f:
-        f.write(body)
+        def rebuild():
+            image_paths[:] = convert_notebook(args.notebook_file_name,
+                args.output_file_name)
+        try:
+            nb_watch.watch(lambda: [args.notebook_file_name] + image_paths, rebuild)
+        except KeyboardInterrupt:
+            pass
+    else:
+        with nb_profile.stage('total', args.notebook_file_name):
+            convert_notebook(args.notebook_file_name, args.output_file_name)
+    if args.profile is not None:
+        nb_profile.get_profiler().write(args.profile, args.profile_format)
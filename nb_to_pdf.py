@@ -2,6 +2,10 @@
 
 import os
 import re
+import glob
+import time
+import traceback
+from multiprocessing import Pool
 import nbformat
 from nbconvert.exporters import LatexExporter, PDFExporter
 from nbconvert.writers import FilesWriter
@@ -9,27 +13,21 @@ from traitlets.config import Config
 import sys
 from jinja2 import DictLoader
 import argparse
+import hashlib
+import io
+import shutil
+import tempfile
+import subprocess
+import nb_profile
+import nb_watch
+import nb_cell_cache
+import nb_low_memory
+import nb_shrink
+from nb_files import (ensure_directory_exists, file_content_hash, write_file_if_changed,
+    link_file_if_changed, copy_file)
 
-def convert_notebook(notebook_filename, output_dir=None, exporter_class=PDFExporter):
-    """Convert notebook. 
-    To PDF unless specified differently by exporter."""
-    assert exporter_class == PDFExporter or exporter_class == LatexExporter
-    (body, resources) = convert_to_body_resources(notebook_filename, exporter_class=exporter_class)
-    if exporter_class == LatexExporter:
-        write_body_resources(notebook_filename, body, resources, output_dir=output_dir)
-    else:
-        write_only_body(notebook_filename, body, output_dir=output_dir)
-        
-    
-def convert_to_body_resources(notebook_filename, exporter_class=PDFExporter):
-    """Convert notebook to body and resources... replaces markdown local images on the way."""
-    ## Read the actual notebook
-    notebook = nbformat.read(notebook_filename, as_version=4)
-    notebook, resources = preprocess_markdown_local_images(notebook, notebook_filename)
-    
-    # Overwrite article style    
-    dl = DictLoader({'article.tplx':
-    """
+# Overwrites the article style of nbconvert
+ARTICLE_TEMPLATE = """
     % Default to the notebook output style
     ((* if not cell_style is defined *))
         ((* set cell_style = 'style_ipython.tplx' *))
@@ -55,19 +53,308 @@ def convert_to_body_resources(notebook_filename, exporter_class=PDFExporter):
         \setlength{\parindent}{0pt}
 
     ((* endblock header *))
-    """})
+    """
+
+# For compile_pdf_incrementally
+LATEX_COMMAND = ['xelatex', '-interaction=nonstopmode', '-halt-on-error']
+LATEX_MAX_PASSES = 3
+# In the latex log if another latex run is needed
+LATEX_RERUN_REGEX = r"Rerun to get|Label\(s\) may have changed|Please rerun LaTeX"
+BIBTEX_COMMAND = ['bibtex']
+# Lines of the .aux file bibtex reads
+AUX_BIBTEX_REGEX = r"^\\(citation|bibdata|bibstyle)\{.*$"
+
+# Finds markdown images like ![Alt text](/path/to/img.jpg "Optional title")
+# (captures img filename in the group)
+IMG_TAG_MATCH_REGEX = r"!\[[^\]]*\]\(([^ \"'\)]*)[^\)]*\)"
+
+def convert_notebook(notebook_filename, output_dir=None, exporter_class=PDFExporter,
+        use_cache=False, incremental=False, build_dir=None, low_memory=False,
+        image_shrinker=None, drop_output_types=()):
+    """Convert notebook. 
+    To PDF unless specified differently by exporter.
+    With use_cache, skip conversion if notebook, its local images and the template
+    did not change since the last conversion into this output dir.
+    With incremental, compile PDF in a persistent build_dir
+    (defaults to .<notebook>_build in output dir), see compile_pdf_incrementally.
+    With low_memory, read the notebook cell by cell and write image outputs
+    to disk right away, see nb_low_memory. PDFs are then always compiled in a
+    build dir (a temporary one unless incremental).
+    Raster images are downscaled with image_shrinker (an nb_shrink.ImageShrinker)
+    if given, outputs having one of drop_output_types are removed.
+    Returns True if notebook was converted, False if skipped."""
+    assert exporter_class == PDFExporter or exporter_class == LatexExporter
+    if use_cache:
+        with nb_profile.stage('build_hash', notebook_filename):
+            build_hash = compute_build_hash(notebook_filename, exporter_class,
+                image_shrinker=image_shrinker, drop_output_types=drop_output_types)
+        if is_up_to_date(notebook_filename, output_dir, exporter_class, build_hash):
+            return False
+    if exporter_class == PDFExporter and (incremental or low_memory):
+        tmp_build_dir = None
+        if not incremental:
+            tmp_build_dir = build_dir = tempfile.mkdtemp(prefix='nb_to_pdf')
+        elif build_dir is None:
+            build_dir = os.path.join(determine_output_dir(notebook_filename, output_dir),
+                '.%s_build' % to_notebook_basename(notebook_filename))
+        try:
+            (body, resources) = convert_to_body_resources(notebook_filename,
+                exporter_class=LatexExporter,
+                spill_dir=build_dir if low_memory else None,
+                image_shrinker=image_shrinker, drop_output_types=drop_output_types)
+            pdf_filename = compile_pdf_incrementally(notebook_filename, body, resources,
+                build_dir)
+            with nb_profile.stage('write', notebook_filename):
+                write_pdf_file(notebook_filename, pdf_filename, output_dir=output_dir)
+        finally:
+            if tmp_build_dir is not None:
+                shutil.rmtree(tmp_build_dir, ignore_errors=True)
+    else:
+        spill_dir = None
+        if low_memory:
+            spill_dir = determine_output_dir(notebook_filename, output_dir)
+        (body, resources) = convert_to_body_resources(notebook_filename,
+            exporter_class=exporter_class, spill_dir=spill_dir,
+            image_shrinker=image_shrinker, drop_output_types=drop_output_types)
+        with nb_profile.stage('write', notebook_filename):
+            if exporter_class == LatexExporter:
+                write_body_resources(notebook_filename, body, resources, output_dir=output_dir)
+            else:
+                write_only_body(notebook_filename, body, output_dir=output_dir)
+    if use_cache:
+        write_build_hash(notebook_filename, output_dir, exporter_class, build_hash)
+    return True
+
+def compute_build_hash(notebook_filename, exporter_class, image_shrinker=None,
+        drop_output_types=()):
+    """Hash of everything the output depends on: notebook content,
+    bytes of local markdown images, exporter, article template
+    and the image size and output types passed to latex."""
+    build_hash = hashlib.sha1()
+    build_hash.update(exporter_class.__name__.encode('utf8'))
+    build_hash.update(ARTICLE_TEMPLATE.encode('utf8'))
+    if image_shrinker is not None:
+        build_hash.update('{:s} {!r}'.format(image_shrinker.settings_key,
+            image_shrinker.shrink_jpeg).encode('utf8'))
+    build_hash.update(' '.join(sorted(drop_output_types)).encode('utf8'))
+    # in blocks, a notebook with many large outputs may not fit into memory twice
+    with open(notebook_filename, 'rb') as notebook_file:
+        for block in iter(lambda: notebook_file.read(1024 * 1024), b''):
+            build_hash.update(block)
+    for img_path in find_local_image_paths(notebook_filename):
+        build_hash.update(img_path.encode('utf8'))
+        if os.path.exists(img_path):
+            with open(img_path, 'rb') as img_file:
+                for block in iter(lambda: img_file.read(1024 * 1024), b''):
+                    build_hash.update(block)
+    return build_hash.hexdigest()
+
+def find_local_image_paths(notebook_filename):
+    """Paths of local images referenced in markdown cells.
+    Reads the notebook as plain json (much faster than nbformat with validation),
+    one cell at a time if ijson is installed, see nb_low_memory.iter_notebook_items."""
+    notebook_dir = os.path.dirname(notebook_filename)
+    img_paths = []
+    with open(notebook_filename, 'rb') as notebook_file:
+        for key, value in nb_low_memory.iter_notebook_items(notebook_file):
+            if key != 'cells' or value.get('cell_type') != 'markdown':
+                continue
+            source = value.get('source', '')
+            if isinstance(source, list):
+                source = ''.join(source)
+            for img_filename in re.findall(IMG_TAG_MATCH_REGEX, source):
+                img_paths.append(os.path.join(notebook_dir, img_filename))
+    return img_paths
+
+def build_hash_filename(notebook_filename, output_dir, exporter_class):
+    output_dir = determine_output_dir(notebook_filename, output_dir)
+    return os.path.join(output_dir, '.{:s}{:s}.buildhash'.format(
+        to_notebook_basename(notebook_filename),
+        output_extension(exporter_class)))
+
+def output_extension(exporter_class):
+    if exporter_class == LatexExporter:
+        return '.tex'
+    else:
+        return '.pdf'
+
+def is_up_to_date(notebook_filename, output_dir, exporter_class, build_hash):
+    """Output exists and was built from the same inputs (same build hash)."""
+    output_filename = os.path.join(determine_output_dir(notebook_filename, output_dir),
+        to_notebook_basename(notebook_filename) + output_extension(exporter_class))
+    hash_filename = build_hash_filename(notebook_filename, output_dir, exporter_class)
+    if not (os.path.exists(output_filename) and os.path.exists(hash_filename)):
+        return False
+    with open(hash_filename, 'r') as hash_file:
+        return hash_file.read().strip() == build_hash
+
+def write_build_hash(notebook_filename, output_dir, exporter_class, build_hash):
+    hash_filename = build_hash_filename(notebook_filename, output_dir, exporter_class)
+    with open(hash_filename, 'w') as hash_file:
+        hash_file.write(build_hash)
         
-    if exporter_class is None:
-        exporter = LatexExporter(extra_loaders=[dl])
+
+def convert_notebooks(notebook_filenames, n_jobs=1, **convert_kwargs):
+    """Convert several notebooks, in parallel if n_jobs > 1.
+    convert_kwargs are passed on to convert_notebook.
+    Failing notebooks do not stop the others, returns list of
+    (notebook_filename, converted, error or None, seconds) tuples."""
+    if convert_kwargs.get('output_dir') is not None:
+        check_unique_basenames(notebook_filenames)
+    profiler = nb_profile.get_profiler()
+    job_args = [(notebook_filename, convert_kwargs, profiler is not None)
+        for notebook_filename in notebook_filenames]
+    if n_jobs == 1 or len(job_args) < 2:
+        results = [convert_notebook_isolated(args) for args in job_args]
     else:
-        exporter = exporter_class(extra_loaders=[dl])
-    (body, resources) = exporter.from_notebook_node(notebook,resources=resources)
+        pool = Pool(processes=n_jobs)
+        try:
+            # chunksize 1 since notebooks can differ a lot in conversion time
+            results = pool.map(convert_notebook_isolated, job_args, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    if profiler is not None:
+        # records of the worker processes
+        for result in results:
+            profiler.add_records(result[4])
+    return [result[:4] for result in results]
+
+def check_unique_basenames(notebook_filenames):
+    """Notebooks converted into one output dir would overwrite each other's
+    outputs (and build dirs) if they had the same name."""
+    basenames = [to_notebook_basename(f) for f in notebook_filenames]
+    duplicates = set(n for n in basenames if basenames.count(n) > 1)
+    assert len(duplicates) == 0, (
+        "Notebook names must be unique with --outdir, got duplicates: " +
+        ", ".join(sorted(duplicates)))
+
+def convert_notebook_isolated(args):
+    """Convert one notebook, catch any error so a batch can continue.
+    Takes one tuple of arguments to be usable with Pool.map.
+    Profiles into a new profiler if asked to and returns its records,
+    since worker processes can not add to the profiler of the main process."""
+    notebook_filename, convert_kwargs, profile = args
+    start_time = time.time()
+    converted = False
+    error = None
+    profiler = nb_profile.Profiler() if profile else None
+    previous_profiler = nb_profile.set_profiler(profiler)
+    try:
+        with nb_profile.stage('total', notebook_filename):
+            converted = convert_notebook(notebook_filename, **convert_kwargs)
+    except Exception:
+        error = traceback.format_exc()
+    finally:
+        nb_profile.set_profiler(previous_profiler)
+    records = profiler.records if profile else []
+    return notebook_filename, converted, error, time.time() - start_time, records
+
+def find_notebook_filenames(paths):
+    """Expand directories (recursively) and glob patterns to notebook filenames.
+    Skips .ipynb_checkpoints folders."""
+    notebook_filenames = []
+    for path in paths:
+        if os.path.isdir(path):
+            for dir_name, sub_dir_names, filenames in os.walk(path):
+                sub_dir_names[:] = sorted(d for d in sub_dir_names
+                    if d != '.ipynb_checkpoints')
+                notebook_filenames.extend(os.path.join(dir_name, f)
+                    for f in sorted(filenames) if f.endswith('.ipynb'))
+        elif os.path.exists(path):
+            notebook_filenames.append(path)
+        else:
+            notebook_filenames.extend(sorted(glob.glob(path)))
+    return notebook_filenames
+
+def print_batch_summary(results):
+    failed = [r for r in results if r[2] is not None]
+    skipped = [r for r in results if r[2] is None and not r[1]]
+    for notebook_filename, converted, error, seconds in results:
+        if error is not None:
+            status = 'FAIL'
+        elif converted:
+            status = 'OK  '
+        else:
+            status = 'SKIP'
+        print("{:s} {:7.2f}s {:s}".format(status, seconds, notebook_filename))
+    for notebook_filename, converted, error, seconds in failed:
+        print("\nError converting {:s}:\n{:s}".format(notebook_filename, error))
+    total_seconds = sum(r[3] for r in results)
+    print("\n{:d} converted, {:d} up to date, {:d} failed, {:.2f}s total conversion time".format(
+        len(results) - len(failed) - len(skipped), len(skipped), len(failed),
+        total_seconds))
+    
+# One exporter per exporter class, reused for all notebooks converted in this process,
+# so the article template chain is only loaded and compiled once
+_exporters = dict()
+
+def get_exporter(exporter_class=PDFExporter, low_memory=False):
+    """Exporter with our article style, created only once per process.
+    The low_memory one is for notebooks read with nb_low_memory.read_notebook."""
+    if exporter_class is None:
+        exporter_class = LatexExporter
+    if (exporter_class, low_memory) not in _exporters:
+        # Overwrite article style
+        dl = DictLoader({'article.tplx': ARTICLE_TEMPLATE})
+        config = nb_low_memory.exporter_config() if low_memory else None
+        exporter = exporter_class(config=config, extra_loaders=[dl])
+        # markdown cells that did not change are not sent through pandoc again
+        nb_cell_cache.install(exporter)
+        _exporters[(exporter_class, low_memory)] = exporter
+    return _exporters[(exporter_class, low_memory)]
+
+def convert_to_body_resources(notebook_filename, exporter_class=PDFExporter, spill_dir=None,
+        image_shrinker=None, drop_output_types=()):
+    """Convert notebook to body and resources... replaces markdown local images on the way.
+    For the PDFExporter, the export stage includes running latex.
+    If spill_dir is given, the notebook is read in low-memory mode, image outputs
+    are written to <spill_dir>/<notebook>_files and added to resources['local_files'].
+    Outputs having one of drop_output_types are removed, output and local images
+    are downscaled with image_shrinker (an nb_shrink.ImageShrinker) if given."""
+    ## Read the actual notebook
+    with nb_profile.stage('read', notebook_filename):
+        if spill_dir is None:
+            notebook = nbformat.read(notebook_filename, as_version=4)
+        else:
+            notebook_name = to_notebook_basename(notebook_filename)
+            notebook, spilled_files = nb_low_memory.read_notebook(notebook_filename,
+                spill_dir, '%s_files' % notebook_name, notebook_name)
+    with nb_profile.stage('local_images', notebook_filename):
+        notebook, resources = preprocess_markdown_local_images(notebook, notebook_filename)
+    if spill_dir is not None:
+        resources['local_files'].update(spilled_files)
+
+    with nb_profile.stage('shrink', notebook_filename):
+        for cell in notebook['cells']:
+            if cell['cell_type'] == 'code' and 'outputs' in cell:
+                cell['outputs'] = nb_shrink.strip_outputs(cell['outputs'], drop_output_types)
+        if image_shrinker is not None:
+            image_shrinker.shrink_cell_outputs(notebook['cells'])
+            image_shrinker.shrink_local_files(resources)
+    
+    if exporter_class == PDFExporter:
+        # pdf exporter writes the images into its own temporary directory,
+        # so it needs the bytes
+        with nb_profile.stage('local_images', notebook_filename):
+            load_local_files(resources)
+    
+    # all markdown cells through one pandoc process instead of one per cell
+    with nb_profile.stage('markdown', notebook_filename):
+        nb_cell_cache.prerender_template_cells(notebook['cells'])
+
+    with nb_profile.stage('export', notebook_filename):
+        exporter = get_exporter(exporter_class, low_memory=spill_dir is not None)
+        (body, resources) = exporter.from_notebook_node(notebook,resources=resources)
     return body, resources
     
     
 def preprocess_markdown_local_images(notebook, notebook_filename):
     """ Replace markdown local images by corresponding latex code and 
     add images to resources.
+    Images are not read, but added to resources['local_files'] as
+    resource key -> (image path, content hash), identical images
+    (e.g. same file referenced by different paths) get only one resource key.
     Side effect: modifies notebook object itself."""
     ## Initialize resources to have correct output directory
     notebook_name = to_notebook_basename(notebook_filename)
@@ -80,78 +367,51 @@ def preprocess_markdown_local_images(notebook, notebook_filename):
    
     # Find local images with 
     #![Alt text](/path/to/img.jpg "Optional title") tags
-    # read out image files and add to resources dict
+    # add image files to resources dict
     resources['outputs'] = dict()
+    resources['local_files'] = dict()
+    content_hash_to_name = dict()
+
+    def replace_img_tag(match):
+        img_filename = match.group(1)
+        img_path = os.path.join(notebook_dir, img_filename)
+        content_hash = file_content_hash(img_path)
+        if content_hash in content_hash_to_name:
+            img_no_dir_name = content_hash_to_name[content_hash]
+        else:
+            # replace directory by two __
+            # could lead to name collisions but quite unlikely...
+            # just in case there is for examplea file img/1.jpg
+            # and a file img__1.jpg...
+            img_no_dir_name = "__".join(os.path.split(img_filename))
+            content_hash_to_name[content_hash] = img_no_dir_name
+            resource_key = os.path.join(resources['output_files_dir'], img_no_dir_name)
+            resources['local_files'][resource_key] = (img_path, content_hash)
+        # Replace the whole image tag by latex code with the changed filename
+        return ("\\begin{center}\n" +
+            "\\adjustimage{max size={0.9\\linewidth}{0.9\\paperheight}}{" +
+            resources['output_files_dir'] + "/" + img_no_dir_name + "}\n" +
+            "\\end{center}\n")
+
     for cell in notebook['cells']:
         if cell['cell_type'] == 'markdown':
-            # It will find the images. Hopefully. (it will capture img filename by capturing imggroup)
-            img_tag_match_regex = r"!\[[^\]]*\]\(([^ \"'\)]*)[^\)]*\)"
-            all_img_filenames = re.findall(img_tag_match_regex, cell['source'])
-
-            for img_filename in all_img_filenames:
-                # replace directory by two __
-                # could lead to name collisions but quite unlikely...
-                # just in case there is for examplea file img/1.jpg
-                # and a file img__1.jpg...
-                img_no_dir_name = "__".join(os.path.split(img_filename))
-                resource_key = os.path.join(resources['output_files_dir'], img_no_dir_name)
-                img_path = os.path.join(notebook_dir, img_filename)
-                with open(img_path, 'rb') as img_file:
-                    data = img_file.read()
-                    resources['outputs'][resource_key] = data
-                
-            # Replace the whole image tag by latex code with the complete filename
-            # We now still have the filename with the path/directory structure, 
-            # so put markers around it (fix_adjust_image)
-            # to later replace the forward slashes
-            # by two underscores
-            marker = 'fix_adjust_image'
-            # make sure marker does not exist in the cell source
-            # just repeat the marker until it is not in the string anymore
-            while marker in cell['source']:
-                marker += 'fix_adjust_image'
-            
-            cell['source'] = re.sub(img_tag_match_regex,
-                   "\\\\begin{center}\n" +
-                   "\\\\adjustimage{max size={0.9\\linewidth}{0.9\\paperheight}}{" + 
-                   resources['output_files_dir'] + "/" +
-                    marker +
-                   r"\1" + # \1 is the filename (by backreference to group matched by parantheses)
-                   marker +
-                   "}\n"+ 
-                   "\\end{center}\n",
-                   cell['source'])
-            
-            # now split it by the marker and correct the filenames 
-            # (replace "/" by "__")
-            cell_src_parts = re.split(marker, cell['source'])
-            for i in xrange(len(cell_src_parts)):
-                # now every odd index will be a filename
-                # in case there is no match there will be only one element
-                # in the list (the original string) and this will not change anything
-                if i % 2 == 1:
-                    cell_src_parts[i] = "__".join(os.path.split(cell_src_parts[i]))
-            cell['source'] = ''.join(cell_src_parts)
+            # finds images, reads them and replaces them, all in one pass
+            cell['source'] = re.sub(IMG_TAG_MATCH_REGEX, replace_img_tag, cell['source'])
     return notebook, resources
     
     
     
+def load_local_files(resources):
+    """Read local files into resources['outputs'], for exporters that need the bytes."""
+    for key, (path, _) in resources.get('local_files', dict()).items():
+        with open(path, 'rb') as local_file:
+            resources['outputs'][key] = local_file.read()
+    resources['local_files'] = dict()
+
 def to_notebook_basename(notebook_filename):
     """Only keep file basename (remove directory and .ipynb extension)"""
     return os.path.split(notebook_filename)[1].replace('.ipynb', '')
 
-def ensure_directory_exists(directory_name):
-    """Ensure directory exists by creating it if it does not exist.
-    Ignores empty string."""
-    # see http://stackoverflow.com/a/273227/1469195
-    # there is a exotic race condition here, that I couldn't really care less about :P
-    # (if the directory is created (e.g., from another program)
-    # between the if check and the os makedirs,
-    # there will be an error...)
-    if not os.path.exists(directory_name) and not directory_name == '':
-        os.makedirs(directory_name)
-    
-
 def write_body_resources(notebook_filename, body, resources, output_dir=None):
     """Write actual notebook and files to output dir.
     Use notebook directory if output dir is none"""
@@ -159,8 +419,19 @@ def write_body_resources(notebook_filename, body, resources, output_dir=None):
     config = Config()
     config.FilesWriter.build_directory = output_dir
     file_writer = FilesWriter(config=config)
-    file_writer.write(body, resources, notebook_name=to_notebook_basename(notebook_filename))
-    
+    # we write the files ourselves, skipping unchanged ones
+    body_resources = dict(resources)
+    body_resources['outputs'] = dict()
+    file_writer.write(body, body_resources, notebook_name=to_notebook_basename(notebook_filename))
+    for key, data in resources['outputs'].items():
+        filename = os.path.join(output_dir, key)
+        ensure_directory_exists(os.path.dirname(filename))
+        write_file_if_changed(filename, data)
+    for key, (path, content_hash) in resources.get('local_files', dict()).items():
+        filename = os.path.join(output_dir, key)
+        ensure_directory_exists(os.path.dirname(filename))
+        link_file_if_changed(path, filename, content_hash)
+
 def write_only_body(notebook_filename, body, output_dir=None):
     output_dir = determine_output_dir(notebook_filename, output_dir)
     config = Config()
@@ -171,6 +442,119 @@ def write_only_body(notebook_filename, body, output_dir=None):
     # add pdf to filename
     file_writer.write(body, resources, notebook_name=to_notebook_basename(notebook_filename))
     
+def write_pdf_file(notebook_filename, pdf_filename, output_dir=None):
+    """Copy compiled pdf to the output dir, without reading it into memory."""
+    output_dir = determine_output_dir(notebook_filename, output_dir)
+    ensure_directory_exists(output_dir)
+    copy_file(pdf_filename, os.path.join(output_dir,
+        to_notebook_basename(notebook_filename) + '.pdf'))
+
+def compile_pdf_incrementally(notebook_filename, body, resources, build_dir):
+    """Compile latex body to pdf in a build dir that is kept between runs,
+    so .aux/.toc etc. of the last run are reused. Skips latex completely
+    if body and resources did not change, otherwise reruns latex only as long
+    as the log asks for it. Runs bibtex after the first latex pass if the document
+    cites something and has a bibliography, unless the citations and bibtex files
+    did not change since bibtex last ran. Returns filename of the pdf."""
+    notebook_name = to_notebook_basename(notebook_filename)
+    pdf_filename = os.path.join(build_dir, notebook_name + '.pdf')
+    hash_filename = os.path.join(build_dir, '.%s.texhash' % notebook_name)
+    tex_hash = hashlib.sha1(body.encode('utf8'))
+    for key in sorted(resources['outputs']):
+        tex_hash.update(key.encode('utf8'))
+        tex_hash.update(resources['outputs'][key])
+    for key in sorted(resources.get('local_files', dict())):
+        tex_hash.update(key.encode('utf8'))
+        tex_hash.update(resources['local_files'][key][1].encode('utf8'))
+    tex_hash = tex_hash.hexdigest()
+    if os.path.exists(pdf_filename) and os.path.exists(hash_filename):
+        with open(hash_filename, 'r') as hash_file:
+            if hash_file.read().strip() == tex_hash:
+                return pdf_filename
+    with nb_profile.stage('write_build_dir', notebook_filename):
+        write_body_resources(notebook_filename, body, resources, output_dir=build_dir)
+    ran_bibtex = False
+    for _ in range(LATEX_MAX_PASSES):
+        with nb_profile.stage('latex', notebook_filename):
+            process = subprocess.Popen(LATEX_COMMAND + [notebook_name + '.tex'],
+                cwd=build_dir, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT)
+            output = process.communicate()[0]
+        if process.returncode != 0:
+            raise RuntimeError("Latex failed for {:s}, see {:s}:\n{:s}".format(
+                notebook_filename, os.path.join(build_dir, notebook_name + '.log'),
+                output.decode('utf8', 'replace')[-2000:]))
+        if not ran_bibtex:
+            ran_bibtex = True
+            with nb_profile.stage('bibtex', notebook_filename):
+                if run_bibtex_if_changed(notebook_filename, build_dir):
+                    # latex has to read the new .bbl
+                    continue
+        with io.open(os.path.join(build_dir, notebook_name + '.log'), 'r',
+                encoding='utf8', errors='replace') as log_file:
+            if re.search(LATEX_RERUN_REGEX, log_file.read()) is None:
+                break
+    with open(hash_filename, 'w') as hash_file:
+        hash_file.write(tex_hash)
+    return pdf_filename
+
+def run_bibtex_if_changed(notebook_filename, build_dir):
+    """Run bibtex in the build dir if the .aux file of the last latex run has
+    citations and a bibliography, and they or the bibtex files changed since
+    bibtex last ran. Bibtex files are also searched next to the notebook.
+    Returns True if bibtex ran."""
+    notebook_name = to_notebook_basename(notebook_filename)
+    notebook_dir = os.path.dirname(os.path.abspath(notebook_filename))
+    bib_hash = compute_bibtex_hash(os.path.join(build_dir, notebook_name + '.aux'),
+        [build_dir, notebook_dir])
+    if bib_hash is None:
+        return False
+    hash_filename = os.path.join(build_dir, '.%s.bibhash' % notebook_name)
+    if os.path.exists(os.path.join(build_dir, notebook_name + '.bbl')) and (
+            os.path.exists(hash_filename)):
+        with open(hash_filename, 'r') as hash_file:
+            if hash_file.read().strip() == bib_hash:
+                return False
+    env = dict(os.environ)
+    # empty entry at the end keeps the default search path
+    env['BIBINPUTS'] = os.pathsep.join([notebook_dir, env.get('BIBINPUTS', '')])
+    process = subprocess.Popen(BIBTEX_COMMAND + [notebook_name], cwd=build_dir, env=env,
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = process.communicate()[0]
+    # 1 means warnings, e.g. for a missing entry, like PDFExporter
+    # a failing bibtex does not fail the conversion
+    if process.returncode > 1:
+        print("Bibtex failed for {:s}, see {:s}:\n{:s}".format(notebook_filename,
+            os.path.join(build_dir, notebook_name + '.blg'),
+            output.decode('utf8', 'replace')[-2000:]))
+    else:
+        with open(hash_filename, 'w') as hash_file:
+            hash_file.write(bib_hash)
+    return True
+
+def compute_bibtex_hash(aux_filename, bib_dirs):
+    """Hash of the citations, bibliography style and bibtex files in the .aux file
+    (files looked up in bib_dirs), None if it cites nothing or has no bibliography."""
+    if not os.path.exists(aux_filename):
+        return None
+    with io.open(aux_filename, 'r', encoding='utf8', errors='replace') as aux_file:
+        bib_lines = [match.group(0) for match in
+            re.finditer(AUX_BIBTEX_REGEX, aux_file.read(), re.MULTILINE)]
+    bib_names = [name.strip() for line in bib_lines if line.startswith('\\bibdata{')
+        for name in line[len('\\bibdata{'):].rstrip('}').split(',')]
+    if len(bib_names) == 0 or not any(l.startswith('\\citation{') for l in bib_lines):
+        return None
+    bib_hash = hashlib.sha1('\n'.join(bib_lines).encode('utf8'))
+    for bib_name in bib_names:
+        if not bib_name.endswith('.bib'):
+            bib_name += '.bib'
+        for bib_dir in bib_dirs:
+            bib_filename = os.path.join(bib_dir, bib_name)
+            if os.path.exists(bib_filename):
+                bib_hash.update(file_content_hash(bib_filename).encode('utf8'))
+                break
+    return bib_hash.hexdigest()
+
 def determine_output_dir(notebook_filename, output_dir):
     if output_dir is None:
         notebook_base_dir = os.path.split(notebook_filename)[0]
@@ -183,9 +567,10 @@ def parse_command_line_arguments():
         description="""Convert notebook to pdf an experiment from a YAML experiment file.
         Example: ./convert_nb_to_pdf.py notebooks/Example_Notebook.yaml --outdir out --pdf """
     )
-    parser.add_argument('notebook_file_name', action='store',
+    parser.add_argument('notebook_file_names', action='store', nargs='+',
                         choices=None,
-                        help='File name of notebook to convert')
+                        help='File names of notebooks to convert, '
+                        'directories and glob patterns are expanded')
     
     group_convert_type = parser.add_mutually_exclusive_group(required=True)
     
@@ -194,17 +579,97 @@ def parse_command_line_arguments():
     parser.add_argument('--outdir', action='store',
                         default=None,
                         help='Directory to write latex or pdf output to. Defaults to same directory as notebook.')
+    parser.add_argument('--jobs', action='store', type=int,
+                        default=1,
+                        help='Number of notebooks to convert in parallel.')
+    parser.add_argument('--force', action='store_true',
+                        help='Convert even if notebook and its images did not change since last conversion.')
+    nb_profile.add_command_line_arguments(parser)
+    parser.add_argument('--cache-dir', action='store',
+                        default=os.path.join(os.path.expanduser('~'), '.cache', 'nb_to_pdf'),
+                        help='Directory to cache rendered markdown cells and '
+                        'downscaled images in.')
+    parser.add_argument('--watch', action='store_true',
+                        help='Keep running and convert again whenever a notebook '
+                        'or one of its local images changes.')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Compile pdf in a build directory kept between runs, '
+                        'only rerun latex as often as needed.')
+    parser.add_argument('--build-dir', action='store',
+                        default=None,
+                        help='Build directory for --incremental. '
+                        'Defaults to .<notebook>_build in the output directory.')
+    nb_low_memory.add_command_line_arguments(parser)
+    nb_shrink.add_command_line_arguments(parser)
     args = parser.parse_args()
     return args
     
 if __name__ == '__main__':
     args = parse_command_line_arguments()
-    notebook_filename = args.notebook_file_name
+    notebook_filenames = find_notebook_filenames(args.notebook_file_names)
     output_dir = args.outdir
+    if output_dir is not None:
+        check_unique_basenames(notebook_filenames)
+
+    if args.profile is not None:
+        nb_profile.set_profiler(nb_profile.Profiler())
+    nb_cell_cache.get_markdown_cache().use_cache_dir(os.path.join(args.cache_dir, 'cells'))
+    if args.memory_limit is not None:
+        # inherited, every worker process of --jobs gets the same limit
+        nb_low_memory.set_memory_limit(args.memory_limit)
+
+    image_shrinker = None
+    if args.image_dpi > 0:
+        image_shrinker = nb_shrink.ImageShrinker(args.image_dpi,
+            cache_dir=os.path.join(args.cache_dir, 'shrunk'), shrink_jpeg=args.shrink_jpeg)
 
     if args.pdf:
         exporter_class = PDFExporter
     else:
         exporter_class = LatexExporter
         
-    convert_notebook(notebook_filename, output_dir=output_dir, exporter_class=exporter_class)
\ No newline at end of file
+    failed = False
+    if args.watch:
+        def watched_paths():
+            paths = list(notebook_filenames)
+            for notebook_filename in notebook_filenames:
+                paths.extend(find_local_image_paths(notebook_filename))
+            return paths
+
+        def rebuild():
+            # in this process, so the exporter stays loaded,
+            # build cache skips notebooks that did not change
+            for notebook_filename in notebook_filenames:
+                if convert_notebook(notebook_filename, output_dir=output_dir,
+                        exporter_class=exporter_class, use_cache=True,
+                        incremental=args.incremental, build_dir=args.build_dir,
+                        low_memory=args.low_memory, image_shrinker=image_shrinker,
+                        drop_output_types=args.drop_output_types):
+                    print("Converted " + notebook_filename)
+        try:
+            nb_watch.watch(watched_paths, rebuild, fallback_paths=notebook_filenames)
+        except KeyboardInterrupt:
+            pass
+    elif len(notebook_filenames) == 1 and args.notebook_file_names == notebook_filenames:
+        with nb_profile.stage('total', notebook_filenames[0]):
+            converted = convert_notebook(notebook_filenames[0], output_dir=output_dir,
+                exporter_class=exporter_class, use_cache=not args.force,
+                incremental=args.incremental, build_dir=args.build_dir,
+                low_memory=args.low_memory, image_shrinker=image_shrinker,
+                drop_output_types=args.drop_output_types)
+        if not converted:
+            print("{:s} is up to date, use --force to convert anyway.".format(
+                notebook_filenames[0]))
+    else:
+        # build dir per notebook, so only the default build dir makes sense here
+        results = convert_notebooks(notebook_filenames, n_jobs=args.jobs,
+            output_dir=output_dir, exporter_class=exporter_class,
+            use_cache=not args.force, incremental=args.incremental,
+            low_memory=args.low_memory, image_shrinker=image_shrinker,
+            drop_output_types=args.drop_output_types)
+        print_batch_summary(results)
+        failed = any(error is not None for _, _, error, _ in results)
+    if args.profile is not None:
+        nb_profile.get_profiler().write(args.profile, args.profile_format)
+    if failed:
+        sys.exit(1)
\ No newline at end of file
@@ -1,6 +1,5 @@
 #!/usr/bin/env python
 import os.path
-import sys
 import nbformat
 from jinja2 import DictLoader
 from nbconvert.exporters import LatexExporter
@@ -10,106 +9,24 @@ import requests
 import re
 from nbconvert.preprocessors.svg2pdf import SVG2PDFPreprocessor
 import base64
-import Image
-from ipython_genutils.tempdir import TemporaryDirectory
+try:
+    from PIL import Image
+except ImportError:
+    import Image
+import io
+import hashlib
+import json
+import threading
+import argparse
+import nb_profile
+import nb_cell_cache
+import nb_low_memory
+import nb_shrink
+from nb_files import (ensure_directory_exists, write_file_if_changed, write_file_atomically,
+    link_file_if_changed, thread_map)
 
-
-
-def convert_notebook(notebook_filename, bibtex_filename):
-    (body, resources) = convert_to_body_resources(notebook_filename, bibtex_filename)
-    write_body_resources(notebook_filename, body, resources)
-    
-
-def convert_to_body_resources(notebook_filename, bibtex_filename):
-    ## Initializing resources to have correct output directory
-    notebook_name = notebook_filename.split('/')[-1].replace('.ipynb', '')
-    #see https://github.com/jupyter/nbconvert/blob/fcc3a831295b373a7a9ee5e8e0dea175475f8f26/nbconvert/nbconvertapp.py#L288
-    resources = {}
-    #resources['config_dir'] = self.config_dir
-    resources['unique_key'] = notebook_name
-    resources['output_files_dir'] = '%s_files' % notebook_name
-
-    own_notebook = nbformat.read(notebook_filename, as_version=4)
-
-    # replace cite keys by bibtex citekeys:
-    if bibtex_filename is not None and 'cite2c' in own_notebook['metadata']:
-        with open(bibtex_filename, 'r') as bibtex_file:
-            bibtex = bibtexparser.load(bibtex_file)
-        cite2_key_to_bibtex_key = dict()
-        for key, cite2c_entry in own_notebook['metadata']['cite2c']['citations'].iteritems():
-            equal_bibtex_entries = [b for b in bibtex.entries if cite2c_bibtex_equal(cite2c_entry,b)]
-            if (len(equal_bibtex_entries) == 1):
-                cite2_key_to_bibtex_key[key] = equal_bibtex_entries[0]['ID']
-            assert len(equal_bibtex_entries) < 2, ("expected at most "
-                "one equal bibtex entry, got {:s}".format(str(equal_bibtex_entries)))
-        for cell in own_notebook['cells']:
-            for cite2_key, bibtex_key in cite2_key_to_bibtex_key.iteritems():
-                if cell['cell_type'] == 'markdown':
-                    cell['source'] = cell['source'].replace(cite2_key, bibtex_key)
-   
-    # find imgs and convert to resources
-    resources['outputs'] = dict()
-    for cell in own_notebook['cells']:
-        if cell['cell_type'] == 'markdown':
-            img_urls_filenames = re.findall(r"<img.*src=\"([^>]*/([^\.]*\.[a-z]*)[^\"]*)\"[^>]*>[^<]*</img>", cell['source'])
-            for url, img_filename in img_urls_filenames:
-                response = requests.get(url, stream=True)
-                all_blocks = []
-                if not response.ok:
-                    continue
-                for block in response.iter_content(1024):
-                    all_blocks.append(block)
-                data = ''.join(all_blocks)
-                if img_filename.endswith('svg'):
-                    svg_2_pdf = SVG2PDFPreprocessor()
-                    pdfdata = svg_2_pdf.convert_figure(None, data)
-                    pdfdata = base64.decodestring(pdfdata) # it is encoded by svg2pdfpreproc.. not sure if decoding is necessary
-                    img_filename = img_filename.replace('.svg', '.pdf')
-                    data = pdfdata
-                if img_filename.endswith('gif'):
-                    jpgdata = gif_to_jpg(data)
-                    img_filename = img_filename.replace('.gif', '.jpg')
-                    data = jpgdata
-                resource_key = os.path.join(resources['output_files_dir'], img_filename)
-                
-                resources['outputs'][resource_key] = data
-                
-            # Replace the whole image tag by latex code with the correct filename
-            cell['source'] = re.sub(r"<img.*src=\"[^>]*/([^\.]*\.[a-z]*)[^>]*>[^<]*</img>", 
-                   "\\\\begin{center}\n" +
-                   "\\\\adjustimage{max size={0.9\\linewidth}{0.9\\paperheight}}{" + 
-                   resources['output_files_dir'] + "/" +
-                   r"\1" + # here is the filename
-                   "}\n"+ 
-                   "\\end{center}\n",
-                   cell['source'])
-            
-            cell['source'] = cell['source'].replace('.svg', '.pdf')
-            cell['source'] = cell['source'].replace('.gif', '.jpg')
-                       
-                       
-    # remove javascript/html outputs
-    for cell in own_notebook['cells']:
-        if cell['cell_type'] == 'code' and 'outputs' in cell:
-            cell['outputs'] = remove_javascript_html_outputs(cell['outputs'])
-        
-        
-    
-    # do some custom replacements of html
-    for cell in own_notebook['cells']:
-        if cell['cell_type'] == 'markdown':
-            cell['source'] = cell['source'].replace('<span class="todecide">', '\\begin{comment}\nTODECIDE\n')
-            cell['source'] = cell['source'].replace('<span class="todo">', '\\begin{comment}\nTODO\n')
-            cell['source'] = cell['source'].replace('</span>', '\n\\end{comment}\n')
-
-            cell['source'] = cell['source'].replace("<div class=\"summary\">", "\\begin{keypointbox}")
-            cell['source'] = cell['source'].replace("</div>", "\\end{keypointbox}")
-
-            cell['source'] = cell['source'].replace("<li>", "\\item ")
-            cell['source'] = cell['source'].replace("</li>", "").replace("<ul>", "").replace("</ul>", "")
-
-    dl = DictLoader({'article.tplx':
-    """
+# Only the body of the document, for including into a thesis
+ARTICLE_TEMPLATE = """
     ((*- extends 'base.tplx' -*))
     ((* block header *))
     ((* endblock header *))
@@ -147,46 +64,531 @@ def convert_to_body_resources(notebook_filename, bibtex_filename):
     ((* endblock markdowncell *))
 
 
-    """})
+    """
+
+# Finds html <img> tags, captures url and filename
+IMG_TAG_URL_FILENAME_REGEX = r"<img.*src=\"([^>]*/([^\.]*\.[a-z]*)[^\"]*)\"[^>]*>[^<]*</img>"
+
+# Custom replacements of html in markdown cells, html -> latex
+HTML_TO_LATEX_REPLACEMENTS = [
+    ('<span class="todecide">', '\\begin{comment}\nTODECIDE\n'),
+    ('<span class="todo">', '\\begin{comment}\nTODO\n'),
+    ('</span>', '\n\\end{comment}\n'),
+    ("<div class=\"summary\">", "\\begin{keypointbox}"),
+    ("</div>", "\\end{keypointbox}"),
+    ("<li>", "\\item "),
+    ("</li>", ""),
+    ("<ul>", ""),
+    ("</ul>", ""),
+    # images are converted to pdf/jpg
+    ('.svg', '.pdf'),
+    ('.gif', '.jpg'),
+]
+
+# Outputs having one of these types are removed by default
+DROPPED_OUTPUT_TYPES = ('text/html', 'application/javascript')
+
+def convert_notebook(notebook_filename, bibtex_filename, image_cache=None,
+        conversion_cache=None, bibtex_cache=None, offline=False, n_threads=8,
+        low_memory=False, image_shrinker=None, drop_output_types=DROPPED_OUTPUT_TYPES):
+    """With low_memory, image outputs are written next to the notebook
+    while reading it, see nb_low_memory."""
+    spill_dir = os.path.dirname(notebook_filename) if low_memory else None
+    (body, resources) = convert_to_body_resources(notebook_filename, bibtex_filename,
+        image_cache=image_cache, conversion_cache=conversion_cache,
+        bibtex_cache=bibtex_cache, offline=offline, n_threads=n_threads,
+        spill_dir=spill_dir, image_shrinker=image_shrinker,
+        drop_output_types=drop_output_types)
+    with nb_profile.stage('write', notebook_filename):
+        write_body_resources(notebook_filename, body, resources)
+    
+
+def convert_to_body_resources(notebook_filename, bibtex_filename, image_cache=None,
+        conversion_cache=None, bibtex_cache=None, offline=False, n_threads=8,
+        spill_dir=None, image_shrinker=None, drop_output_types=DROPPED_OUTPUT_TYPES):
+    """Convert notebook to latex body and resources.
+    Downloads images of <img> tags with n_threads in parallel, using image_cache
+    (an ImageCache) if given. With offline, images are only taken from the cache.
+    svg/gif images are converted with n_threads in parallel, using
+    conversion_cache (a ConversionCache) if given.
+    The bibtex file is indexed for looking up cite2c citations, the index is
+    taken from bibtex_cache (a BibtexIndexCache) if given.
+    If spill_dir is given, the notebook is read in low-memory mode, image outputs
+    are written to <spill_dir>/<notebook>_files and listed in resources['local_files'].
+    Outputs having one of drop_output_types are removed, raster images are
+    downscaled with image_shrinker (an nb_shrink.ImageShrinker) if given."""
+    ## Initializing resources to have correct output directory
+    notebook_name = notebook_filename.split('/')[-1].replace('.ipynb', '')
+    #see https://github.com/jupyter/nbconvert/blob/fcc3a831295b373a7a9ee5e8e0dea175475f8f26/nbconvert/nbconvertapp.py#L288
+    resources = {}
+    #resources['config_dir'] = self.config_dir
+    resources['unique_key'] = notebook_name
+    resources['output_files_dir'] = '%s_files' % notebook_name
+
+    with nb_profile.stage('read', notebook_filename):
+        if spill_dir is None:
+            own_notebook = nbformat.read(notebook_filename, as_version=4)
+        else:
+            own_notebook, resources['local_files'] = nb_low_memory.read_notebook(
+                notebook_filename, spill_dir, resources['output_files_dir'], notebook_name)
+
+    # find bibtex citekeys for cite keys:
+    cite2_key_to_bibtex_key = dict()
+    if bibtex_filename is not None and 'cite2c' in own_notebook['metadata']:
+        with nb_profile.stage('citations', notebook_filename):
+            if bibtex_cache is not None:
+                bibtex_index = bibtex_cache.load(bibtex_filename)
+            else:
+                bibtex_index = BibtexIndex.from_file(bibtex_filename)
+            cite2_key_to_bibtex_key, unmatched, ambiguous = match_citations(
+                own_notebook['metadata']['cite2c']['citations'], bibtex_index)
+        print_citation_report(unmatched, ambiguous)
+
+    # rewrite markdown cells (citations, images, html) and strip outputs,
+    # all in a single pass over the cells
+    resources['outputs'] = dict()
+    img_urls_filenames = []
+    cell_rewriter = make_cell_rewriter(cite2_key_to_bibtex_key,
+        resources['output_files_dir'], img_urls_filenames)
+    with nb_profile.stage('rewrite_cells', notebook_filename):
+        for cell in own_notebook['cells']:
+            if cell['cell_type'] == 'markdown':
+                cell['source'] = cell_rewriter.rewrite(cell['source'])
+            elif cell['cell_type'] == 'code' and 'outputs' in cell:
+                cell['outputs'] = nb_shrink.strip_outputs(cell['outputs'], drop_output_types)
+
+    # download all at once, in parallel
+    with nb_profile.stage('fetch_images', notebook_filename):
+        url_to_data = fetch_images([url for url, _ in img_urls_filenames],
+            image_cache=image_cache, offline=offline, n_threads=n_threads)
+    # convert svg/gif in parallel, every image only once
+    to_convert = [(img_filename, url_to_data[url])
+        for url, img_filename in sorted(set(img_urls_filenames))
+        if url_to_data[url] is not None]
+    with nb_profile.stage('convert_images', notebook_filename):
+        converted = thread_map(lambda args: convert_image(args[0], args[1], conversion_cache),
+            to_convert, n_threads)
+    for img_filename, data in converted:
+        resource_key = os.path.join(resources['output_files_dir'], img_filename)
+        
+        resources['outputs'][resource_key] = data
+
+    if image_shrinker is not None:
+        with nb_profile.stage('shrink', notebook_filename):
+            image_shrinker.shrink_cell_outputs(own_notebook['cells'])
+            image_shrinker.shrink_outputs(resources['outputs'])
+            image_shrinker.shrink_local_files(resources)
 
+    # all markdown cells through one pandoc process instead of one per cell,
+    # same arguments as the markdowncell block of the template
+    with nb_profile.stage('markdown', notebook_filename):
+        nb_cell_cache.prerender_cells(own_notebook['cells'], extra_args=["--chapters"])
 
-    exportLatex = LatexExporter(extra_loaders=[dl])
-    (body, resources) = exportLatex.from_notebook_node(own_notebook,resources=resources)
+    with nb_profile.stage('export', notebook_filename):
+        exportLatex = get_exporter(low_memory=spill_dir is not None)
+        (body, resources) = exportLatex.from_notebook_node(own_notebook,resources=resources)
     
     # postprocess url links with footnotes
     body = re.sub(r"(\\href{([^}]*)}{[^}]*})", r"\1\\footnote{\\url{\2}}", body)
     return body, resources
                 
-def cite2c_bibtex_equal(cite2c_entry, bibtex_entry):
-    title_equal = cite2c_entry['title'] == bibtex_entry['title'].replace('{','').replace('}','')
-    url_equal = 'URL' in cite2c_entry and (cite2c_entry['URL'] == bibtex_entry['link'])
-    if 'URL' not in cite2c_entry:
-        print ("Url not there for", cite2c_entry)
-    return title_equal or url_equal
+def make_cell_rewriter(cite2_key_to_bibtex_key, output_files_dir, img_urls_filenames):
+    """Rewriter for markdown cells replacing cite2c keys by bibtex keys,
+    <img> tags by latex code and some html by latex.
+    Found images are appended to img_urls_filenames as (url, filename) tuples."""
+    rules = []
+    if len(cite2_key_to_bibtex_key) > 0:
+        # longest first, in case one key is a prefix of another
+        cite2_keys = sorted(cite2_key_to_bibtex_key.keys(), key=len, reverse=True)
+        rules.append(('|'.join(re.escape(k) for k in cite2_keys),
+            lambda match: cite2_key_to_bibtex_key[match.group(0)]))
+
+    def replace_img_tag(match):
+        url, img_filename = match.group(1), match.group(2)
+        img_urls_filenames.append((url, img_filename))
+        img_filename = img_filename.replace('.svg', '.pdf').replace('.gif', '.jpg')
+        # Replace the whole image tag by latex code with the correct filename
+        return ("\\begin{center}\n" +
+            "\\adjustimage{max size={0.9\\linewidth}{0.9\\paperheight}}{" +
+            output_files_dir + "/" + img_filename + "}\n" +
+            "\\end{center}\n")
+    rules.append((IMG_TAG_URL_FILENAME_REGEX, replace_img_tag))
+    rules.extend((re.escape(html), latex) for html, latex in HTML_TO_LATEX_REPLACEMENTS)
+    return CellRewriter(rules)
+
+
+class CellRewriter(object):
+    """Rewrites cell sources in a single pass over the text.
+    Rules are (regex, replacement) tuples, replacement is a string or a function
+    of the match. All rules are combined into one compiled regex, at each
+    position the first matching rule wins."""
+    def __init__(self, rules):
+        self.replacements = [replacement for _, replacement in rules]
+        self.n_groups = [re.compile(pattern).groups for pattern, _ in rules]
+        # group number of each rule in the combined regex, its own groups follow
+        self.offsets = []
+        patterns = []
+        offset = 1
+        for i_rule, (pattern, _) in enumerate(rules):
+            self.offsets.append(offset)
+            patterns.append('(?P<rule{:d}>{:s})'.format(i_rule,
+                shift_backreferences(pattern, offset)))
+            offset += 1 + self.n_groups[i_rule]
+        self.combined_regex = re.compile('|'.join(patterns))
+
+    def rewrite(self, source):
+        parts = []
+        position = 0
+        for match in self.combined_regex.finditer(source):
+            i_rule = int(match.lastgroup[len('rule'):])
+            replacement = self.replacements[i_rule]
+            if callable(replacement):
+                replacement = replacement(RuleMatch(match, self.offsets[i_rule],
+                    self.n_groups[i_rule]))
+            parts.append(source[position:match.start()])
+            parts.append(replacement)
+            position = match.end()
+        parts.append(source[position:])
+        return ''.join(parts)
+
+
+class RuleMatch(object):
+    """Match of the combined regex seen with the group numbers of one rule,
+    so its replacement function gets the rule's own groups without matching
+    again (which would lose the context lookarounds, ^ and $ depend on)."""
+    def __init__(self, match, offset, n_groups):
+        self.match = match
+        self.offset = offset
+        self.n_groups = n_groups
+
+    def _index(self, group):
+        # named groups keep their names in the combined regex
+        if isinstance(group, int):
+            return self.offset + group
+        return group
+
+    def group(self, *groups):
+        if len(groups) == 0:
+            groups = (0,)
+        values = tuple(self.match.group(self._index(g)) for g in groups)
+        return values[0] if len(values) == 1 else values
+
+    def groups(self, default=None):
+        return self.match.groups(default)[self.offset:self.offset + self.n_groups]
+
+    def start(self, group=0):
+        return self.match.start(self._index(group))
+
+    def end(self, group=0):
+        return self.match.end(self._index(group))
+
+
+def shift_backreferences(pattern, offset):
+    """Renumber backreferences \\1 .. \\99 of a rule's pattern for the
+    combined regex, where group 1 of the rule is group offset + 1."""
+    return re.sub(r'(?<!\\)((?:\\\\)*)\\([1-9][0-9]?)',
+        lambda m: m.group(1) + '\\' + str(int(m.group(2)) + offset), pattern)
+
+def fetch_images(urls, image_cache=None, offline=False, n_threads=8):
+    """Download images concurrently over one pooled session.
+    Returns dict url -> image data (None if download failed)."""
+    unique_urls = list(set(urls))
+    if len(unique_urls) == 0:
+        return dict()
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=n_threads,
+        pool_maxsize=n_threads)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    try:
+        all_data = thread_map(lambda url: fetch_image(session, url, image_cache, offline),
+            unique_urls, n_threads)
+    finally:
+        session.close()
+    if image_cache is not None:
+        image_cache.evict()
+    return dict(zip(unique_urls, all_data))
+
+
+def fetch_image(session, url, image_cache=None, offline=False):
+    """Download image, revalidate cached copy with etag/last-modified if we have one."""
+    cached_data, metadata = None, dict()
+    if image_cache is not None:
+        cached_data, metadata = image_cache.load(url)
+    if offline:
+        if cached_data is None:
+            print("Offline and not in cache: " + url)
+        return cached_data
+    headers = dict()
+    if cached_data is not None:
+        if 'etag' in metadata:
+            headers['If-None-Match'] = metadata['etag']
+        if 'last_modified' in metadata:
+            headers['If-Modified-Since'] = metadata['last_modified']
+    try:
+        response = session.get(url, headers=headers, timeout=60)
+    except requests.exceptions.RequestException:
+        if cached_data is None:
+            raise
+        print("Download failed, using cached image for " + url)
+        return cached_data
+    if response.status_code == 304 and cached_data is not None:
+        return cached_data
+    if not response.ok:
+        return None
+    data = response.content
+    if image_cache is not None:
+        image_cache.store(url, data, response.headers)
+    return data
+
+
+class ImageCache(object):
+    """Downloaded images on disk, named by hash of the url, etag and
+    last-modified header stored next to them.
+    Least recently used images are removed once the cache is larger than max_bytes."""
+    def __init__(self, cache_dir, max_bytes=500 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        ensure_directory_exists(cache_dir)
+
+    def _filenames(self, url):
+        url_hash = hashlib.sha1(url.encode('utf8')).hexdigest()
+        data_filename = os.path.join(self.cache_dir, url_hash + '.data')
+        return data_filename, data_filename.replace('.data', '.json')
+
+    def load(self, url):
+        """Returns (data, metadata) or (None, {}) if url not in cache."""
+        data_filename, metadata_filename = self._filenames(url)
+        try:
+            with open(data_filename, 'rb') as data_file:
+                data = data_file.read()
+            with open(metadata_filename, 'r') as metadata_file:
+                metadata = json.load(metadata_file)
+            # mark as recently used for eviction
+            os.utime(data_filename, None)
+        except (IOError, OSError, ValueError):
+            return None, dict()
+        return data, metadata
+
+    def store(self, url, data, headers):
+        data_filename, metadata_filename = self._filenames(url)
+        metadata = dict(url=url)
+        if 'ETag' in headers:
+            metadata['etag'] = headers['ETag']
+        if 'Last-Modified' in headers:
+            metadata['last_modified'] = headers['Last-Modified']
+        # other processes may read or evict the same cache directory
+        with self.lock:
+            write_file_atomically(data_filename, data)
+            write_file_atomically(metadata_filename, json.dumps(metadata).encode('utf8'))
+
+    def evict(self):
+        """Remove least recently used images until cache is below max_bytes.
+        Files removed meanwhile (e.g. by another process) are skipped."""
+        with self.lock:
+            mtimes_sizes_filenames = []
+            for filename in os.listdir(self.cache_dir):
+                if not filename.endswith('.data'):
+                    continue
+                data_filename = os.path.join(self.cache_dir, filename)
+                try:
+                    mtimes_sizes_filenames.append((os.path.getmtime(data_filename),
+                        os.path.getsize(data_filename), data_filename))
+                except OSError:
+                    continue
+            total_bytes = sum(size for _, size, _ in mtimes_sizes_filenames)
+            for _, size, data_filename in sorted(mtimes_sizes_filenames):
+                if total_bytes <= self.max_bytes:
+                    break
+                total_bytes -= size
+                for filename in (data_filename, data_filename.replace('.data', '.json')):
+                    try:
+                        os.remove(filename)
+                    except OSError:
+                        pass
+
+# Exporters reused for all notebooks converted in this process,
+# so the template is only compiled once
+_exporters = dict()
+
+def get_exporter(low_memory=False):
+    """Latex exporter with our body-only article template, created once per process.
+    The low_memory one is for notebooks read with nb_low_memory.read_notebook."""
+    if low_memory not in _exporters:
+        dl = DictLoader({'article.tplx': ARTICLE_TEMPLATE})
+        config = nb_low_memory.exporter_config() if low_memory else None
+        exporter = LatexExporter(config=config, extra_loaders=[dl])
+        # markdown cells that did not change are not sent through pandoc again
+        nb_cell_cache.install(exporter)
+        _exporters[low_memory] = exporter
+    return _exporters[low_memory]
+
+def match_citations(cite2c_citations, bibtex_index):
+    """Find bibtex key for every cite2c citation.
+    Returns dict cite2c key -> bibtex key, list of unmatched cite2c keys
+    and dict cite2c key -> all matching bibtex keys for ambiguous citations."""
+    cite2_key_to_bibtex_key = dict()
+    unmatched = []
+    ambiguous = dict()
+    for key, cite2c_entry in cite2c_citations.items():
+        bibtex_keys = bibtex_index.lookup(cite2c_entry)
+        if len(bibtex_keys) == 1:
+            cite2_key_to_bibtex_key[key] = bibtex_keys[0]
+        elif len(bibtex_keys) == 0:
+            unmatched.append(key)
+        else:
+            ambiguous[key] = bibtex_keys
+    return cite2_key_to_bibtex_key, unmatched, ambiguous
+
+def print_citation_report(unmatched, ambiguous):
+    for key in sorted(unmatched):
+        print("No bibtex entry found for citation " + key)
+    for key in sorted(ambiguous):
+        print("Several bibtex entries found for citation {:s}: {:s}".format(
+            key, ", ".join(ambiguous[key])))
+
+
+def normalize_title(title):
+    """Without bibtex braces, lower case, whitespace collapsed."""
+    return ' '.join(title.replace('{', '').replace('}', '').lower().split())
+
+
+class BibtexIndex(object):
+    """Bibtex keys indexed by normalized title and by url,
+    so a citation is looked up without scanning all entries."""
+    def __init__(self, title_to_keys, url_to_keys):
+        self.title_to_keys = title_to_keys
+        self.url_to_keys = url_to_keys
+
+    @classmethod
+    def from_file(cls, bibtex_filename):
+        with open(bibtex_filename, 'r') as bibtex_file:
+            bibtex = bibtexparser.load(bibtex_file)
+        title_to_keys = dict()
+        url_to_keys = dict()
+        for entry in bibtex.entries:
+            title = normalize_title(entry.get('title', ''))
+            if title != '':
+                title_to_keys.setdefault(title, []).append(entry['ID'])
+            for url_field in ('link', 'url'):
+                if url_field in entry:
+                    url_to_keys.setdefault(entry[url_field], []).append(entry['ID'])
+        return cls(title_to_keys, url_to_keys)
+
+    def lookup(self, cite2c_entry):
+        """All bibtex keys with equal title or equal url as the cite2c entry.
+        Entries without title only match by url."""
+        keys = []
+        title = normalize_title(cite2c_entry.get('title', ''))
+        if title != '':
+            keys.extend(self.title_to_keys.get(title, []))
+        if 'URL' in cite2c_entry:
+            keys.extend(self.url_to_keys.get(cite2c_entry['URL'], []))
+        # unique, keep order
+        return [k for i_key, k in enumerate(keys) if k not in keys[:i_key]]
+
+
+class BibtexIndexCache(object):
+    """BibtexIndex stored on disk (and in memory), so the bibtex file is only
+    parsed again after it changed (checked by mtime and size, then content hash)."""
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.loaded = dict()
+        ensure_directory_exists(cache_dir)
+
+    def load(self, bibtex_filename):
+        bibtex_filename = os.path.abspath(bibtex_filename)
+        stat = os.stat(bibtex_filename)
+        memory_key = (bibtex_filename, stat.st_mtime, stat.st_size)
+        if memory_key in self.loaded:
+            return self.loaded[memory_key]
+        cache_filename = os.path.join(self.cache_dir,
+            hashlib.sha1(bibtex_filename.encode('utf8')).hexdigest() + '.json')
+        cached = None
+        try:
+            with open(cache_filename, 'r') as cache_file:
+                cached = json.load(cache_file)
+        except (IOError, OSError, ValueError):
+            pass
+        if (cached is not None and cached['mtime'] == stat.st_mtime and
+                cached['size'] == stat.st_size):
+            index = BibtexIndex(cached['title_to_keys'], cached['url_to_keys'])
+        else:
+            with open(bibtex_filename, 'rb') as bibtex_file:
+                content_hash = hashlib.sha1(bibtex_file.read()).hexdigest()
+            if cached is not None and cached['sha1'] == content_hash:
+                # only touched, not changed
+                index = BibtexIndex(cached['title_to_keys'], cached['url_to_keys'])
+            else:
+                index = BibtexIndex.from_file(bibtex_filename)
+            with open(cache_filename, 'w') as cache_file:
+                json.dump(dict(mtime=stat.st_mtime, size=stat.st_size, sha1=content_hash,
+                    title_to_keys=index.title_to_keys, url_to_keys=index.url_to_keys),
+                    cache_file)
+        self.loaded[memory_key] = index
+        return index
+
+def convert_image(img_filename, data, conversion_cache=None):
+    """Convert svg to pdf and gif to jpg, other images are kept.
+    Returns new filename and data."""
+    if img_filename.endswith('svg'):
+        new_img_filename = img_filename.replace('.svg', '.pdf')
+    elif img_filename.endswith('gif'):
+        new_img_filename = img_filename.replace('.gif', '.jpg')
+    else:
+        return img_filename, data
+    extension = os.path.splitext(new_img_filename)[1]
+    if conversion_cache is not None:
+        converted_data = conversion_cache.load(data, extension)
+        if converted_data is not None:
+            return new_img_filename, converted_data
+    if img_filename.endswith('svg'):
+        svg_2_pdf = SVG2PDFPreprocessor()
+        # svg is text for the preprocessor, the pdf comes back base64 encoded
+        pdfdata = svg_2_pdf.convert_figure(None, data.decode('utf8'))
+        converted_data = base64.b64decode(pdfdata)
+    else:
+        converted_data = gif_to_jpg(data)
+    if conversion_cache is not None:
+        conversion_cache.store(data, extension, converted_data)
+    return new_img_filename, converted_data
+
+
+class ConversionCache(object):
+    """Converted images on disk, named by hash of the original image data
+    and the extension they were converted to."""
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        ensure_directory_exists(cache_dir)
+
+    def _filename(self, data, extension):
+        return os.path.join(self.cache_dir, hashlib.sha1(data).hexdigest() + extension)
+
+    def load(self, data, extension):
+        """Returns converted data or None if not in cache."""
+        try:
+            with open(self._filename(data, extension), 'rb') as converted_file:
+                return converted_file.read()
+        except (IOError, OSError):
+            return None
+
+    def store(self, data, extension, converted_data):
+        write_file_atomically(self._filename(data, extension), converted_data)
 
 def gif_to_jpg(gif_data):
-    with TemporaryDirectory() as tmpdir:
-        gif_file_name = os.path.join(tmpdir, 'temp-file.gif')
-        open(gif_file_name, 'wb').write(gif_data)
-        jpg_file_name = os.path.join(tmpdir, 'temp-file.jpg')
-        gif_img = Image.open(gif_file_name)
-        gif_img.convert('RGB').save(jpg_file_name)
-        jpg_data = open(jpg_file_name, 'rb').read()
-    return jpg_data
-
-def remove_javascript_html_outputs(outputs):
-    # text html and application javascript should be in keys of output data
-    # if we have html/javascript output
-    outputs = [o for o in outputs if (('data' not in o) or ('text/html' not in o['data']))]
-    outputs = [o for o in outputs if (('data' not in o) or ('application/javascript' not in o['data']))]
-    return outputs
+    """Convert in memory, no temporary files needed."""
+    gif_img = Image.open(io.BytesIO(gif_data))
+    jpg_file = io.BytesIO()
+    gif_img.convert('RGB').save(jpg_file, format='JPEG')
+    return jpg_file.getvalue()
 
 def write_body_resources(notebook_filename, body, resources):
     notebook_file_base_name = notebook_filename.replace('.ipynb', '')
     tex_filename = notebook_file_base_name + '.tex'
-    print tex_filename
-    with open(tex_filename, 'w') as tex_file:
-        tex_file.write(body.encode('utf8'))
+    print(tex_filename)
+    with io.open(tex_filename, 'w', encoding='utf8') as tex_file:
+        tex_file.write(body)
     
     # Now store resources
     notebook_dir = os.path.dirname(notebook_filename)
@@ -200,12 +602,61 @@ def write_body_resources(notebook_filename, body, resources):
         if not key.endswith('svg'):
             val = resources['outputs'][key]
             resource_filename = os.path.join(notebook_dir, key)
-            with open(resource_filename, 'wb') as resource_file:
-                resource_file.write(val)
+            write_file_if_changed(resource_filename, val)
+    # written while reading in low-memory mode, unless downscaled since
+    for key, (path, content_hash) in resources.get('local_files', dict()).items():
+        link_file_if_changed(path, os.path.join(notebook_dir, key), content_hash)
+
+
+def parse_command_line_arguments():
+    parser = argparse.ArgumentParser(
+        description="""Convert notebook to latex body for including into a thesis.
+        Example: ./nb_to_tex.py notebooks/Example_Notebook.ipynb --bibtex thesis.bib"""
+    )
+    parser.add_argument('notebook_file_name', action='store',
+                        help='File name of notebook to convert')
+    parser.add_argument('--bibtex', action='store',
+                        default='latex-only-tex/Deep_EEG_Learning.bib',
+                        help='Bibtex file to look up cite2c citations.')
+    parser.add_argument('--cache-dir', action='store',
+                        default=os.path.join(os.path.expanduser('~'), '.cache', 'nb_to_tex'),
+                        help='Directory to cache downloaded, converted and downscaled images, '
+                        'the bibtex index and rendered markdown cells in.')
+    parser.add_argument('--image-cache-size', action='store', type=int,
+                        default=500,
+                        help='Maximum size of downloaded image cache in megabytes.')
+    parser.add_argument('--offline', action='store_true',
+                        help='Do not download images, only use cached ones.')
+    parser.add_argument('--threads', action='store', type=int,
+                        default=8,
+                        help='Number of images downloaded or converted in parallel.')
+    nb_profile.add_command_line_arguments(parser)
+    nb_low_memory.add_command_line_arguments(parser)
+    nb_shrink.add_command_line_arguments(parser, DROPPED_OUTPUT_TYPES)
+    args = parser.parse_args()
+    return args
 
 if __name__ == '__main__':
-    if (len(sys.argv) != 2):
-        print ("Usage: ./convert_latex.py notebookfilename")
-        sys.exit(0)
-    convert_notebook(sys.argv[1], 'latex-only-tex/Deep_EEG_Learning.bib')
+    args = parse_command_line_arguments()
+    image_cache = ImageCache(os.path.join(args.cache_dir, 'images'),
+        max_bytes=args.image_cache_size * 1024 * 1024)
+    conversion_cache = ConversionCache(os.path.join(args.cache_dir, 'conversions'))
+    bibtex_cache = BibtexIndexCache(os.path.join(args.cache_dir, 'bibtex'))
+    nb_cell_cache.get_markdown_cache().use_cache_dir(os.path.join(args.cache_dir, 'cells'))
+    if args.profile is not None:
+        nb_profile.set_profiler(nb_profile.Profiler())
+    if args.memory_limit is not None:
+        nb_low_memory.set_memory_limit(args.memory_limit)
+    image_shrinker = None
+    if args.image_dpi > 0:
+        image_shrinker = nb_shrink.ImageShrinker(args.image_dpi,
+            cache_dir=os.path.join(args.cache_dir, 'shrunk'), n_threads=args.threads,
+            shrink_jpeg=args.shrink_jpeg)
+    with nb_profile.stage('total', args.notebook_file_name):
+        convert_notebook(args.notebook_file_name, args.bibtex, image_cache=image_cache,
+            conversion_cache=conversion_cache, bibtex_cache=bibtex_cache,
+            offline=args.offline, n_threads=args.threads, low_memory=args.low_memory,
+            image_shrinker=image_shrinker, drop_output_types=args.drop_output_types)
+    if args.profile is not None:
+        nb_profile.get_profiler().write(args.profile, args.profile_format)
     
@@ -0,0 +1,59 @@
+"""Rebuild whenever watched files change, by polling their modification times
+(no extra dependency and works the same on every platform)."""
+import os
+import time
+import traceback
+
+
+def watch(get_paths, rebuild, interval=0.2, debounce=0.3, fallback_paths=()):
+    """Call rebuild once and then whenever one of the files from get_paths() changes.
+    Waits until files did not change for debounce seconds, so a burst of saves
+    causes only one rebuild. get_paths is called again after every rebuild,
+    since e.g. referenced images can change with the notebook. If it fails,
+    the paths from before are watched, fallback_paths (e.g. the notebooks)
+    if it never succeeded.
+    Runs until interrupted."""
+    paths = run_rebuild(rebuild, get_paths, list(fallback_paths))
+    file_states = snapshot(paths)
+    while True:
+        time.sleep(interval)
+        new_file_states = snapshot(paths)
+        if new_file_states == file_states:
+            continue
+        # wait until saving is finished
+        while True:
+            time.sleep(debounce)
+            newer_file_states = snapshot(paths)
+            if newer_file_states == new_file_states:
+                break
+            new_file_states = newer_file_states
+        paths = run_rebuild(rebuild, get_paths, paths)
+        file_states = snapshot(paths)
+
+def run_rebuild(rebuild, get_paths, previous_paths):
+    """Rebuild, errors are printed not raised, so watching continues.
+    Returns paths to watch from now on, previous_paths if get_paths fails
+    (e.g. on a notebook that is not valid json yet)."""
+    start_time = time.time()
+    try:
+        rebuild()
+        print("Rebuilt in {:.2f}s".format(time.time() - start_time))
+    except Exception:
+        print("Rebuild failed:\n" + traceback.format_exc())
+    try:
+        return get_paths()
+    except Exception:
+        print("Could not determine files to watch, watching the same files as "
+            "before:\n" + traceback.format_exc())
+        return previous_paths
+
+def snapshot(paths):
+    """Modification time and size of every path, None for missing files."""
+    file_states = dict()
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            file_states[path] = (stat.st_mtime, stat.st_size)
+        except OSError:
+            file_states[path] = None
+    return file_states
@@ -19,7 +19,10 @@ setup(
         "Topic :: Publication :: Jupyter Notebook :: Conversion PDF HTML LATEX",
         ], 
         
-    scripts=['nb_to_html.py', 'nb_to_pdf.py', 'nb_to_tex.py'],
+    scripts=['nb_to_html.py', 'nb_to_pdf.py', 'nb_to_tex.py', 'nb_server.py',
+        'nb_to_book.py'],
+    py_modules=['nb_to_html', 'nb_to_pdf', 'nb_to_tex', 'nb_profile',
+        'nb_watch', 'nb_cell_cache', 'nb_low_memory', 'nb_shrink', 'nb_files'],
     keywords="",
     author="Robin Tibor Schirrmeister",
     author_email="robintibor@googlegroups.com",
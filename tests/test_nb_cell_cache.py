@@ -0,0 +1,94 @@
+import pytest
+
+pytest.importorskip('nbconvert')
+from nbconvert.filters import markdown2latex, convert_pandoc
+from nbconvert.utils.pandoc import get_pandoc_version, PandocMissing
+from nbconvert.utils.exceptions import ConversionException
+import nb_cell_cache
+
+try:
+    get_pandoc_version()
+    has_pandoc = True
+except PandocMissing:
+    has_pandoc = False
+needs_pandoc = pytest.mark.skipif(not has_pandoc, reason="pandoc not installed")
+
+SOURCES = [
+    "Some *emphasis* and `code`.",
+    "- first\n- second\n\n      indented code",
+    "$$x^2 + y^2$$\n\nInline $\\alpha$ math.",
+    "```\nfenced code\n```",
+    "A footnote[^1].\n\n[^1]: First cell's note.",
+    "Another footnote[^1].\n\n[^1]: Second cell's note.",
+    "# Results\n\nText",
+    "# Results\n\nMore text",
+    "A [reference link][ref].",
+    "[ref]: http://example.com",
+    "(@) example item",
+    "Title\n=====",
+    "",
+    "Last plain paragraph.",
+]
+
+
+@needs_pandoc
+def test_prerendered_cells_equal_cells_rendered_alone(tmpdir):
+    cache = nb_cell_cache.MarkdownCache(str(tmpdir))
+    n_rendered = cache.prerender(SOURCES)
+    assert n_rendered > 1
+    for source in SOURCES:
+        assert cache.markdown2latex(source) == markdown2latex(source)
+
+
+@needs_pandoc
+def test_prerender_with_extra_args():
+    cache = nb_cell_cache.MarkdownCache()
+    sources = ["Some *text*.", "More **text**."]
+    assert cache.prerender(sources, extra_args=["--number-sections"]) == 2
+    for source in sources:
+        assert (cache.markdown2latex(source, extra_args=["--number-sections"]) ==
+            markdown2latex(source, extra_args=["--number-sections"]))
+
+
+def test_cells_depending_on_other_cells_are_not_batched():
+    batched = [s for s in SOURCES if nb_cell_cache.NOT_BATCHED_REGEX.search(s) is None]
+    assert batched == [SOURCES[i] for i in (0, 1, 2, 3, 8, 12, 13)]
+
+
+@needs_pandoc
+def test_failed_pandoc_is_not_cached(tmpdir):
+    cache = nb_cell_cache.MarkdownCache(str(tmpdir))
+    sources = ["Some *text*.", "More **text**."]
+    with pytest.raises(ConversionException):
+        cache.markdown2latex(sources[0], extra_args=["--no-such-option"])
+    with pytest.raises(ConversionException):
+        cache.prerender(sources, extra_args=["--no-such-option"])
+    for source in sources:
+        assert cache.get(cache.key(source, extra_args=["--no-such-option"])) is None
+    assert tmpdir.listdir() == []
+
+
+@needs_pandoc
+def test_chapters_argument_works_with_every_pandoc():
+    cache = nb_cell_cache.MarkdownCache()
+    assert cache.markdown2latex("# Title", extra_args=["--chapters"]).startswith(
+        "\\chapter")
+
+
+@needs_pandoc
+def test_prerendered_template_cells_equal_template_pipeline():
+    if nb_cell_cache.resolve_references is None:
+        pytest.skip("templates of this nbconvert use markdown2latex")
+    sources = SOURCES + ["See [the intro](#Intro) and \\\\(x^2\\\\) inline.",
+        "Only in *this* test."]
+    cells = [{'cell_type': 'markdown', 'source': source} for source in sources]
+    assert nb_cell_cache.prerender_template_cells(cells) > 1
+    cache = nb_cell_cache.get_markdown_cache()
+    for source in sources:
+        # the markdowncell block of the nbconvert latex templates
+        expected = convert_pandoc(nb_cell_cache.resolve_references(convert_pandoc(source,
+            nb_cell_cache.TEMPLATE_MARKDOWN_FORMAT, 'json', extra_args=[])), 'json', 'latex')
+        cached = cache.convert_pandoc(nb_cell_cache.resolve_references(cache.convert_pandoc(
+            source, nb_cell_cache.TEMPLATE_MARKDOWN_FORMAT, 'json', extra_args=[])),
+            'json', 'latex')
+        assert cached == expected
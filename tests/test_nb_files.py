@@ -0,0 +1,70 @@
+import os
+from nb_files import (file_content_hash, write_file_if_changed, link_file_if_changed,
+    copy_file, thread_map)
+
+
+def write(filename, data):
+    with open(filename, 'wb') as f:
+        f.write(data)
+
+def read(filename):
+    with open(filename, 'rb') as f:
+        return f.read()
+
+
+def test_link_file_if_changed_links_and_skips_unchanged(tmpdir):
+    source = str(tmpdir.join('source.png'))
+    target = str(tmpdir.join('target.png'))
+    write(source, b'image')
+    link_file_if_changed(source, target, file_content_hash(source))
+    assert read(target) == b'image'
+    mtime = os.stat(target).st_mtime
+    link_file_if_changed(source, target, file_content_hash(source))
+    assert os.stat(target).st_mtime == mtime
+
+
+def test_link_file_if_changed_replaces_changed_target(tmpdir):
+    source = str(tmpdir.join('source.png'))
+    target = str(tmpdir.join('target.png'))
+    write(source, b'new image')
+    write(target, b'old image')
+    link_file_if_changed(source, target, file_content_hash(source))
+    assert read(target) == b'new image'
+
+
+def test_writing_linked_file_keeps_source(tmpdir):
+    # output files are hardlinked to user images and cache files,
+    # writing new content must not change those
+    source = str(tmpdir.join('cache.png'))
+    target = str(tmpdir.join('out.png'))
+    write(source, b'downscaled')
+    link_file_if_changed(source, target, file_content_hash(source))
+    write_file_if_changed(target, b'full size')
+    assert read(target) == b'full size'
+    assert read(source) == b'downscaled'
+
+
+def test_copy_file_keeps_file_linked_to_target(tmpdir):
+    linked = str(tmpdir.join('linked.pdf'))
+    target = str(tmpdir.join('target.pdf'))
+    source = str(tmpdir.join('source.pdf'))
+    write(linked, b'old')
+    write(source, b'new')
+    link_file_if_changed(linked, target, file_content_hash(linked))
+    copy_file(source, target)
+    assert read(target) == b'new'
+    assert read(linked) == b'old'
+
+
+def test_write_file_if_changed_skips_same_content(tmpdir):
+    filename = str(tmpdir.join('a.png'))
+    write_file_if_changed(filename, b'data')
+    inode = os.stat(filename).st_ino
+    write_file_if_changed(filename, b'data')
+    assert os.stat(filename).st_ino == inode
+    assert os.listdir(str(tmpdir)) == ['a.png']
+
+
+def test_thread_map_keeps_order():
+    assert thread_map(lambda x: x * 2, list(range(20)), 4) == list(range(0, 40, 2))
+    assert thread_map(lambda x: x, [], 4) == []
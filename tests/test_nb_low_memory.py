@@ -0,0 +1,59 @@
+import io
+import json
+import base64
+import pytest
+
+pytest.importorskip('nbformat')
+import nbformat
+import nb_low_memory
+
+NOTEBOOK_JSON = {
+    'cells': [
+        {'cell_type': 'markdown', 'metadata': {}, 'source': ['# Title\n', 'text']},
+        {'cell_type': 'code', 'execution_count': 1, 'metadata': {'scrolled': True},
+         'source': 'x = 1.5', 'outputs': [
+            {'output_type': 'execute_result', 'execution_count': 1, 'metadata': {},
+             'data': {'text/plain': '1.5', 'image/png': base64.b64encode(
+                 b'png data').decode('ascii')}}]},
+        {'cell_type': 'raw', 'metadata': {}, 'source': ''},
+    ],
+    'metadata': {'kernelspec': {'name': 'python3', 'display_name': 'Python 3',
+        'language': 'python'}, 'ratio': 0.25, 'empty': [], 'none': None},
+    'nbformat': 4,
+    'nbformat_minor': 2,
+}
+
+
+@pytest.fixture(params=['ijson', 'json'])
+def iter_mode(request, monkeypatch):
+    if request.param == 'json':
+        monkeypatch.setattr(nb_low_memory, 'ijson', None)
+    elif nb_low_memory.ijson is None:
+        pytest.skip('ijson not installed')
+    return request.param
+
+
+def test_iter_notebook_items(iter_mode):
+    notebook_file = io.BytesIO(json.dumps(NOTEBOOK_JSON).encode('utf8'))
+    items = list(nb_low_memory.iter_notebook_items(notebook_file))
+    assert [value for key, value in items if key == 'cells'] == NOTEBOOK_JSON['cells']
+    other = dict((key, value) for key, value in items if key != 'cells')
+    assert other == dict((key, value) for key, value in NOTEBOOK_JSON.items()
+        if key != 'cells')
+    assert isinstance(other['metadata']['ratio'], float)
+
+def test_read_notebook_spills_images(tmpdir, iter_mode):
+    notebook_filename = str(tmpdir.join('notebook.ipynb'))
+    with open(notebook_filename, 'w') as notebook_file:
+        json.dump(NOTEBOOK_JSON, notebook_file)
+    out_dir = str(tmpdir.join('out'))
+    notebook, local_files = nb_low_memory.read_notebook(notebook_filename, out_dir,
+        'notebook_files', 'output')
+    nbformat.validate(notebook)
+    assert notebook.cells[0].source == '# Title\ntext'
+    output = notebook.cells[1].outputs[0]
+    assert output['data']['image/png'] == ''
+    assert output['metadata']['filenames']['image/png'] == 'notebook_files/output_1_0.png'
+    path, _ = local_files['notebook_files/output_1_0.png']
+    with open(path, 'rb') as img_file:
+        assert img_file.read() == b'png data'
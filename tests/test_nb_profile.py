@@ -0,0 +1,58 @@
+import sys
+import csv
+import json
+import subprocess
+import nb_profile
+
+
+BUSY_CHILD = "import time\nstart = time.time()\nwhile time.time() - start < 0.3: pass"
+
+
+def test_stage_records_time_of_child_processes():
+    profiler = nb_profile.Profiler()
+    previous = nb_profile.set_profiler(profiler)
+    try:
+        with nb_profile.stage('pandoc', notebook='a.ipynb'):
+            subprocess.check_call([sys.executable, '-c', BUSY_CHILD])
+    finally:
+        nb_profile.set_profiler(previous)
+    record, = profiler.records
+    assert record['stage'] == 'pandoc'
+    assert record['notebook'] == 'a.ipynb'
+    assert record['wall_seconds'] >= 0.3
+    # the child process was busy, this one only waited
+    assert record['cpu_seconds'] >= 0.2
+
+
+def test_stage_without_profiler_records_nothing():
+    assert nb_profile.get_profiler() is None
+    with nb_profile.stage('export'):
+        pass
+
+
+def test_write_formats(tmpdir):
+    records = []
+    profiler = nb_profile.Profiler(callback=records.append)
+    with profiler.stage('read', notebook='a.ipynb'):
+        pass
+    with profiler.stage('export', notebook='a.ipynb'):
+        pass
+    assert records == profiler.records
+
+    profiler.write(str(tmpdir.join('profile.csv')))
+    with open(str(tmpdir.join('profile.csv'))) as csv_file:
+        rows = list(csv.DictReader(csv_file))
+    assert [row['stage'] for row in rows] == ['read', 'export']
+    assert sorted(rows[0].keys()) == sorted(nb_profile.CSV_FIELDS)
+
+    profiler.write(str(tmpdir.join('profile.json')))
+    with open(str(tmpdir.join('profile.json'))) as json_file:
+        assert json.load(json_file) == json.loads(json.dumps(profiler.records))
+
+    profiler.write(str(tmpdir.join('trace.json')), file_format='chrome')
+    with open(str(tmpdir.join('trace.json'))) as json_file:
+        events = json.load(json_file)['traceEvents']
+    assert [(e['name'], e['cat'], e['ph']) for e in events] == [
+        ('read', 'a.ipynb', 'X'), ('export', 'a.ipynb', 'X')]
+    assert events[0]['ts'] <= events[1]['ts']
+    assert 'process_peak_rss_mb' in events[0]['args']
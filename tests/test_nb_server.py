@@ -0,0 +1,104 @@
+import os
+import json
+import time
+import threading
+import pytest
+
+pytest.importorskip('nbconvert')
+import nb_server
+try:
+    from urllib.request import urlopen, Request
+    from urllib.error import HTTPError
+except ImportError:
+    from urllib2 import urlopen, Request, HTTPError
+
+
+def fake_job(job):
+    """Stands in for run_job in the worker processes."""
+    if job.get('crash'):
+        os._exit(1)
+    time.sleep(job.get('sleep', 0))
+    return dict(status='ok', converted=True, seconds=job.get('sleep', 0))
+
+
+@pytest.fixture
+def make_server():
+    servers = []
+    def make(n_workers=1, max_queued=0, job_timeout=10):
+        server = nb_server.ConversionServer(('127.0.0.1', 0), n_workers=n_workers,
+            max_queued=max_queued, job_timeout=job_timeout, job_function=fake_job)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        servers.append(server)
+        return server
+    yield make
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def post(server, content):
+    """Returns (http status, json response)."""
+    url = 'http://127.0.0.1:{:d}/convert'.format(server.server_address[1])
+    try:
+        response = urlopen(Request(url, data=content.encode('utf8')), timeout=30)
+        return response.getcode(), json.loads(response.read().decode('utf8'))
+    except HTTPError as e:
+        return e.code, json.loads(e.read().decode('utf8'))
+
+
+def wait_for_no_jobs(server, timeout=10):
+    start_time = time.time()
+    while server.n_jobs > 0 and time.time() - start_time < timeout:
+        time.sleep(0.05)
+    return server.n_jobs
+
+
+def test_invalid_jobs_are_rejected(make_server):
+    server = make_server()
+    assert post(server, 'not json')[0] == 400
+    code, response = post(server, json.dumps(dict(notebook='a.ipynb', format='doc')))
+    assert code == 400
+    assert response['error'].startswith('Format should be one of')
+    code, response = post(server, json.dumps(dict(notebook_json={}, name='../a',
+        format='html')))
+    assert code == 400
+    assert server.n_jobs == 0
+
+
+def test_full_queue_rejects_jobs(make_server):
+    server = make_server(n_workers=1, max_queued=0)
+    results = []
+    running = threading.Thread(target=lambda: results.append(server.submit(dict(sleep=1))))
+    running.start()
+    while server.n_jobs == 0:
+        time.sleep(0.01)
+    code, response = post(server, json.dumps(dict(notebook_json={}, name='a', format='html')))
+    assert code == 503
+    assert response['error'] == 'Job queue is full'
+    running.join()
+    assert results[0]['status'] == 'ok'
+    assert wait_for_no_jobs(server) == 0
+
+
+def test_timed_out_job_keeps_its_slot_until_finished(make_server):
+    server = make_server(n_workers=1, max_queued=0, job_timeout=0.2)
+    # warm up the worker, so the timeout only measures the job
+    assert server.submit(dict())['status'] == 'ok'
+    result = server.submit(dict(sleep=1))
+    assert result['status'] == 'error'
+    assert result['error'].startswith('Timeout')
+    assert server.submit(dict()) is None
+    assert wait_for_no_jobs(server) == 0
+    assert server.submit(dict())['status'] == 'ok'
+
+
+def test_died_worker_releases_its_slot(make_server):
+    server = make_server(n_workers=1, max_queued=0)
+    result = server.submit(dict(crash=True))
+    assert result['status'] == 'error'
+    assert result['error'] == 'Worker process died during the job'
+    assert wait_for_no_jobs(server) == 0
+    # a new pool takes the following jobs
+    assert server.submit(dict())['status'] == 'ok'
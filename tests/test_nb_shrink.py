@@ -0,0 +1,69 @@
+import io
+import argparse
+import pytest
+
+Image = pytest.importorskip('PIL.Image')
+import nb_shrink
+
+
+def make_image(size, img_format, dpi=None):
+    img_file = io.BytesIO()
+    img = Image.new('RGB', size, (10, 120, 200))
+    if dpi is None:
+        img.save(img_file, format=img_format)
+    else:
+        img.save(img_file, format=img_format, dpi=dpi)
+    return img_file.getvalue()
+
+def drawn_size_inches(data, shrinker):
+    """Size adjustimage with max size draws the image at."""
+    img = Image.open(io.BytesIO(data))
+    dpi_x, dpi_y = img.info.get('dpi', (72, 72))
+    width, height = img.size[0] / float(dpi_x), img.size[1] / float(dpi_y)
+    fit = min(1.0, shrinker.max_width_inches / width, shrinker.max_height_inches / height)
+    return width * fit, height * fit
+
+
+@pytest.mark.parametrize('size, dpi', [
+    ((3000, 2000), (300, 300)),
+    ((3000, 2000), None),
+    ((1000, 800), (600, 600)),
+    ((1200, 600), (200, 100)),
+])
+def test_shrink_keeps_drawn_size(size, dpi):
+    shrinker = nb_shrink.ImageShrinker(dpi=100, n_threads=1)
+    data = make_image(size, 'PNG', dpi)
+    shrunk_data = shrinker.shrink(io.BytesIO(data), '.png', 'hash')
+    assert shrunk_data is not None
+    shrunk_img = Image.open(io.BytesIO(shrunk_data))
+    assert shrunk_img.size[0] < size[0]
+    assert drawn_size_inches(shrunk_data, shrinker) == pytest.approx(
+        drawn_size_inches(data, shrinker), rel=0.01)
+    # at most target dpi at the drawn size
+    assert shrunk_img.size[0] / drawn_size_inches(shrunk_data, shrinker)[0] <= 100.5
+
+def test_small_images_are_not_shrunk():
+    shrinker = nb_shrink.ImageShrinker(dpi=300, n_threads=1)
+    data = make_image((200, 100), 'PNG', (72, 72))
+    assert shrinker.shrink(io.BytesIO(data), '.png', 'hash') is None
+
+def test_jpeg_only_shrunk_if_asked_for():
+    data = make_image((3000, 2000), 'JPEG')
+    shrinker = nb_shrink.ImageShrinker(dpi=100, n_threads=1)
+    assert shrinker.shrink(io.BytesIO(data), '.jpg', 'hash') is None
+    shrinker = nb_shrink.ImageShrinker(dpi=100, n_threads=1, shrink_jpeg=True)
+    shrunk_data = shrinker.shrink(io.BytesIO(data), '.jpg', 'hash')
+    assert Image.open(io.BytesIO(shrunk_data)).format == 'JPEG'
+
+def test_image_dpi_argument():
+    parser = argparse.ArgumentParser()
+    nb_shrink.add_command_line_arguments(parser)
+    assert parser.parse_args(['--image-dpi', '50']).image_dpi == 50
+    assert parser.parse_args(['--image-dpi', '0']).image_dpi == 0
+    # downscaling is opt-in
+    assert parser.parse_args([]).image_dpi == 0
+    assert parser.parse_args([]).shrink_jpeg is False
+    with pytest.raises(SystemExit):
+        parser.parse_args(['--image-dpi', '-10'])
+    with pytest.raises(SystemExit):
+        parser.parse_args(['--image-dpi', 'high'])
@@ -0,0 +1,87 @@
+import os
+import base64
+import pytest
+
+pytest.importorskip('nbconvert')
+import nbformat
+from nbconvert.utils.pandoc import get_pandoc_version, PandocMissing
+import nb_to_book
+
+try:
+    get_pandoc_version()
+    has_pandoc = True
+except PandocMissing:
+    has_pandoc = False
+needs_pandoc = pytest.mark.skipif(not has_pandoc, reason="pandoc not installed")
+
+# 1x1 png
+PNG_DATA = base64.b64decode('iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mP8'
+    'z8DwHwAFBQIAX8jx0gAAAABJRU5ErkJggg==')
+
+
+def test_default_preamble_defines_what_chapters_use():
+    preamble = nb_to_book.render_default_preamble()
+    assert preamble.startswith('\\documentclass{report}')
+    for definition in ['\\tightlist', '{longtable}', '{booktabs}', '{Shaded}',
+            '{Highlighting}', '\\KeywordTok', '\\NormalTok', '\\PY@', '{keypointbox}']:
+        assert definition in preamble
+    assert '\\begin{document}' not in preamble
+    assert '\\title' not in preamble
+
+
+def write_chapter(filename, text, png_data):
+    notebook = nbformat.v4.new_notebook()
+    notebook.cells = [nbformat.v4.new_markdown_cell(text),
+        nbformat.v4.new_code_cell('plot()', outputs=[nbformat.v4.new_output('display_data',
+            data={'image/png': base64.b64encode(png_data).decode('ascii'),
+                'text/plain': '<Figure>'})])]
+    nbformat.write(notebook, filename)
+
+
+@pytest.fixture
+def book(tmpdir, monkeypatch):
+    """Manifest of two chapters with the same image output, counts rendered chapters."""
+    write_chapter(str(tmpdir.join('a.ipynb')), 'First *chapter*.', PNG_DATA)
+    write_chapter(str(tmpdir.join('b.ipynb')), 'Second *chapter*.', PNG_DATA)
+    tmpdir.join('book.txt').write('a.ipynb\n# comment\nb.ipynb\n')
+    rendered = []
+    render_chapter = nb_to_book.render_chapter
+    def counting_render_chapter(args):
+        rendered.append(os.path.basename(args[0]))
+        return render_chapter(args)
+    monkeypatch.setattr(nb_to_book, 'render_chapter', counting_render_chapter)
+    return tmpdir, rendered
+
+
+@needs_pandoc
+def test_build_book_only_renders_changed_chapters(book):
+    tmpdir, rendered = book
+    out_dir = str(tmpdir.join('out'))
+    assert nb_to_book.build_book(str(tmpdir.join('book.txt')), out_dir,
+        preamble='') == [(str(tmpdir.join('a.ipynb')), None),
+            (str(tmpdir.join('b.ipynb')), None)]
+    assert rendered == ['a.ipynb', 'b.ipynb']
+    # nothing changed
+    nb_to_book.build_book(str(tmpdir.join('book.txt')), out_dir, preamble='')
+    assert rendered == ['a.ipynb', 'b.ipynb']
+    write_chapter(str(tmpdir.join('b.ipynb')), 'Changed *chapter*.', PNG_DATA)
+    nb_to_book.build_book(str(tmpdir.join('book.txt')), out_dir, preamble='')
+    assert rendered == ['a.ipynb', 'b.ipynb', 'b.ipynb']
+    assert 'Changed \\emph{chapter}.' in tmpdir.join('out', 'chapters', 'b.tex').read()
+    master = tmpdir.join('out', 'book.tex').read()
+    assert '\\input{chapters/a}\n\\input{chapters/b}' in master
+
+
+@needs_pandoc
+def test_build_book_stores_identical_images_once(book):
+    tmpdir, _ = book
+    out_dir = str(tmpdir.join('out'))
+    nb_to_book.build_book(str(tmpdir.join('book.txt')), out_dir, preamble='')
+    shared_files = tmpdir.join('out', 'book_files').listdir()
+    assert len(shared_files) == 1
+    shared_name = 'book_files/' + shared_files[0].basename
+    assert shared_files[0].read_binary() == PNG_DATA
+    for name in ('a', 'b'):
+        chapter = tmpdir.join('out', 'chapters', name + '.tex').read()
+        assert shared_name in chapter
+        assert name + '_files' not in chapter
@@ -0,0 +1,45 @@
+import io
+import base64
+import pytest
+
+pytest.importorskip('nbconvert')
+import nb_to_html
+
+
+def test_write_inlined_html_only_inlines_local_files(tmpdir):
+    tmpdir.join('local.png').write_binary(b'png bytes')
+    body = ('<img src="local.png"><img src="data:image/png;base64,AAAA">'
+        '<img src="https://example.com/a.png"><img src="http://example.com/b.png">'
+        '<img src="local.png">')
+    out_file = io.StringIO()
+    inlined = nb_to_html.write_inlined_html(body, out_file, str(tmpdir))
+    data_url = 'data:image/png;base64,' + base64.b64encode(b'png bytes').decode()
+    assert inlined == [str(tmpdir.join('local.png'))]
+    assert out_file.getvalue() == ('<img src="' + data_url + '">'
+        '<img src="data:image/png;base64,AAAA">'
+        '<img src="https://example.com/a.png"><img src="http://example.com/b.png">'
+        '<img src="' + data_url + '">')
+
+
+class FakeExporter(object):
+    def __init__(self, body):
+        self.body = body
+
+    def from_filename(self, filename):
+        return self.body, dict()
+
+
+def test_convert_notebook_keeps_old_output_if_writing_fails(tmpdir, monkeypatch):
+    output = tmpdir.join('out.html')
+    output.write('old html')
+    monkeypatch.setattr(nb_to_html, 'get_exporter',
+        lambda: FakeExporter('<p>text</p><img src="missing.png">'))
+    with pytest.raises(IOError):
+        nb_to_html.convert_notebook(str(tmpdir.join('nb.ipynb')), str(output))
+    assert output.read() == 'old html'
+    assert [f.basename for f in tmpdir.listdir()] == ['out.html']
+
+    tmpdir.join('missing.png').write_binary(b'png bytes')
+    assert nb_to_html.convert_notebook(str(tmpdir.join('nb.ipynb')), str(output)) == [
+        str(tmpdir.join('missing.png'))]
+    assert output.read().startswith('<p>text</p><img src="data:image/png;base64,')
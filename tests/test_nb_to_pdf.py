@@ -0,0 +1,133 @@
+import os
+import sys
+import pytest
+
+pytest.importorskip('nbconvert')
+import nbformat
+from nbconvert.exporters import LatexExporter
+import nb_low_memory
+import nb_cell_cache
+import nb_to_pdf
+
+
+def write_notebook(tmpdir):
+    notebook = nbformat.v4.new_notebook()
+    notebook.cells = [
+        nbformat.v4.new_markdown_cell("An image ![plot](plot.png) and ![web](http_img.png \"t\")"),
+        nbformat.v4.new_code_cell("# ![not an image](code.png)"),
+        nbformat.v4.new_markdown_cell(["line\n", "![other](sub/other.png)"]),
+    ]
+    notebook_filename = str(tmpdir.join('notebook.ipynb'))
+    nbformat.write(notebook, notebook_filename)
+    return notebook_filename
+
+
+@pytest.fixture(params=['ijson', 'json'])
+def iter_mode(request, monkeypatch):
+    if request.param == 'json':
+        monkeypatch.setattr(nb_low_memory, 'ijson', None)
+    elif nb_low_memory.ijson is None:
+        pytest.skip('ijson not installed')
+    return request.param
+
+
+def test_find_local_image_paths_only_markdown_cells(tmpdir, iter_mode):
+    notebook_filename = write_notebook(tmpdir)
+    assert nb_to_pdf.find_local_image_paths(notebook_filename) == [
+        os.path.join(str(tmpdir), 'plot.png'),
+        os.path.join(str(tmpdir), 'http_img.png'),
+        os.path.join(str(tmpdir), 'sub/other.png')]
+
+
+def test_build_hash_changes_with_image(tmpdir, iter_mode):
+    notebook_filename = write_notebook(tmpdir)
+    first_hash = nb_to_pdf.compute_build_hash(notebook_filename, LatexExporter)
+    assert first_hash == nb_to_pdf.compute_build_hash(notebook_filename, LatexExporter)
+    tmpdir.join('plot.png').write_binary(b'not really a png')
+    assert first_hash != nb_to_pdf.compute_build_hash(notebook_filename, LatexExporter)
+
+
+def test_convert_notebooks_rejects_duplicate_names_with_outdir(tmpdir):
+    notebook_filenames = ['a/report.ipynb', 'b/report.ipynb', 'b/other.ipynb']
+    with pytest.raises(AssertionError) as excinfo:
+        nb_to_pdf.convert_notebooks(notebook_filenames, output_dir=str(tmpdir))
+    assert 'report' in str(excinfo.value)
+    nb_to_pdf.check_unique_basenames(['a/report.ipynb', 'b/other.ipynb'])
+
+
+FAKE_LATEX = r"""
+import re, sys
+name = sys.argv[-1][:-len('.tex')]
+tex = open(name + '.tex').read()
+with open(name + '.aux', 'w') as aux_file:
+    aux_file.write('\\relax\n')
+    for key in re.findall(r'\\cite\{([^}]*)\}', tex):
+        aux_file.write('\\citation{' + key + '}\n')
+    for bib in re.findall(r'\\bibliography\{([^}]*)\}', tex):
+        aux_file.write('\\bibdata{' + bib + '}\n\\bibstyle{plain}\n')
+open(name + '.log', 'w').close()
+open(name + '.pdf', 'w').close()
+with open('calls', 'a') as calls_file:
+    calls_file.write('latex\n')
+"""
+
+FAKE_BIBTEX = r"""
+import sys
+open(sys.argv[-1] + '.bbl', 'w').close()
+with open('calls', 'a') as calls_file:
+    calls_file.write('bibtex\n')
+"""
+
+
+def test_compile_pdf_incrementally_runs_bibtex_if_citations_changed(tmpdir, monkeypatch):
+    tmpdir.join('fake_latex.py').write(FAKE_LATEX)
+    tmpdir.join('fake_bibtex.py').write(FAKE_BIBTEX)
+    monkeypatch.setattr(nb_to_pdf, 'LATEX_COMMAND',
+        [sys.executable, str(tmpdir.join('fake_latex.py'))])
+    monkeypatch.setattr(nb_to_pdf, 'BIBTEX_COMMAND',
+        [sys.executable, str(tmpdir.join('fake_bibtex.py'))])
+    notebook_filename = str(tmpdir.join('paper.ipynb'))
+    tmpdir.join('refs.bib').write('@article{a, title={A}}')
+    build_dir = str(tmpdir.join('build'))
+    resources = dict(outputs=dict(), output_extension='.tex')
+
+    def compile_calls(body):
+        calls_filename = os.path.join(build_dir, 'calls')
+        if os.path.exists(calls_filename):
+            os.remove(calls_filename)
+        nb_to_pdf.compile_pdf_incrementally(notebook_filename, body, resources, build_dir)
+        if not os.path.exists(calls_filename):
+            return []
+        with open(calls_filename) as calls_file:
+            return calls_file.read().split()
+
+    assert compile_calls('No citations') == ['latex']
+    body = 'See \\cite{a}.\n\\bibliography{refs}\n'
+    assert compile_calls(body) == ['latex', 'bibtex', 'latex']
+    # nothing changed
+    assert compile_calls(body) == []
+    # same citations
+    assert compile_calls(body + 'More text.') == ['latex']
+    # bibtex file changed
+    tmpdir.join('refs.bib').write('@article{a, title={Another A}}')
+    assert compile_calls(body) == ['latex', 'bibtex', 'latex']
+
+
+def test_markdown_cells_keep_the_template_pipeline(tmpdir):
+    notebook = nbformat.v4.new_notebook()
+    notebook.cells = [
+        nbformat.v4.new_markdown_cell('# Intro'),
+        nbformat.v4.new_markdown_cell('See [the intro](#Intro) and \\\\(x^2\\\\) inline.'),
+        nbformat.v4.new_markdown_cell('Some *emphasis* only in this test.')]
+    notebook_filename = str(tmpdir.join('notebook.ipynb'))
+    nbformat.write(notebook, notebook_filename)
+    body, _ = nb_to_pdf.convert_to_body_resources(notebook_filename,
+        exporter_class=LatexExporter)
+    # resolve_references and tex_math_double_backslash of the stock template
+    assert 'Section \\ref{intro}' in body
+    assert '\\(x^2\\)' in body
+    cache = nb_cell_cache.get_markdown_cache()
+    source = 'Some *emphasis* only in this test.'
+    document = cache.get(cache.key(source, nb_cell_cache.TEMPLATE_MARKDOWN_FORMAT,
+        'json', extra_args=[]))
+    assert document is not None
@@ -0,0 +1,187 @@
+import io
+import os
+import threading
+import pytest
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+
+pytest.importorskip('nbconvert')
+pytest.importorskip('bibtexparser')
+import nb_to_tex
+
+BIBTEX = """
+@article{deep,
+  title = {Deep {Learning} for EEG},
+  url = {http://example.com/deep}
+}
+@misc{notitle1,
+  url = {http://example.com/notitle}
+}
+@misc{emptytitle,
+  title = {{}}
+}
+@article{deep2,
+  title = {deep learning   for eeg}
+}
+"""
+
+
+@pytest.fixture
+def bibtex_index(tmpdir):
+    bibtex_file = tmpdir.join('refs.bib')
+    bibtex_file.write(BIBTEX)
+    return nb_to_tex.BibtexIndex.from_file(str(bibtex_file))
+
+
+def test_lookup_by_normalized_title_and_url(bibtex_index):
+    assert bibtex_index.lookup(dict(title='Deep Learning for EEG')) == ['deep', 'deep2']
+    assert bibtex_index.lookup(dict(title='Deep Learning for EEG',
+        URL='http://example.com/deep')) == ['deep', 'deep2']
+    assert bibtex_index.lookup(dict(URL='http://example.com/notitle')) == ['notitle1']
+    assert bibtex_index.lookup(dict(title='Something else')) == []
+
+def test_lookup_without_title_does_not_match_untitled_entries(bibtex_index):
+    assert bibtex_index.lookup(dict()) == []
+    assert bibtex_index.lookup(dict(title='')) == []
+    assert bibtex_index.lookup(dict(title='{}', URL='http://example.com/other')) == []
+
+
+def test_cell_rewriter_single_pass_first_rule_wins():
+    rewriter = nb_to_tex.CellRewriter([('ab', 'X'), ('a', 'b'), ('b', 'c')])
+    # replacements are not rewritten again, at one position the first rule wins
+    assert rewriter.rewrite('ab a b aab') == 'X b c bX'
+    assert rewriter.rewrite('') == ''
+    assert rewriter.rewrite('nothing') == 'nothing'
+
+def test_cell_rewriter_function_gets_its_own_groups():
+    rewriter = nb_to_tex.CellRewriter([
+        (r'(x)(y)', 'XY'),
+        (r'<(\w+)>', lambda match: '[' + match.group(1).upper() + ']')])
+    assert rewriter.rewrite('<tag> xy <b>') == '[TAG] XY [B]'
+
+def test_cell_rewriter_function_rules_keep_their_context():
+    rewriter = nb_to_tex.CellRewriter([
+        (r'(a)(b)', 'AB'),
+        # lookbehind and ^ only hold in the whole source, not in the match alone
+        (r'(?<=\$)(\d+)', lambda match: '<' + match.group(1) + '>'),
+        (r'^(x)', lambda match: match.group(0).upper()),
+        # numbered backreference to the rule's own group
+        (r'(\w)\1', lambda match: match.group(1) + match.groups()[0].upper())])
+    assert rewriter.rewrite('x $12 ab 34 xx') == 'X $<12> AB 34 xX'
+
+def test_make_cell_rewriter():
+    img_urls_filenames = []
+    rewriter = nb_to_tex.make_cell_rewriter(
+        {'cite2c:ab': 'key_ab', 'cite2c:abc': 'key_abc'}, 'nb_files', img_urls_filenames)
+    source = ('See cite2c:abc and cite2c:ab.\n'
+        '<img src="http://example.com/figs/plot.svg?raw=true"></img>\n'
+        '<div class="summary">Key point</div>')
+    assert rewriter.rewrite(source) == ('See key_abc and key_ab.\n'
+        '\\begin{center}\n'
+        '\\adjustimage{max size={0.9\\linewidth}{0.9\\paperheight}}{nb_files/plot.pdf}\n'
+        '\\end{center}\n\n'
+        '\\begin{keypointbox}Key point\\end{keypointbox}')
+    assert img_urls_filenames == [('http://example.com/figs/plot.svg?raw=true', 'plot.svg')]
+
+
+def test_convert_image_uses_conversion_cache(tmpdir):
+    cache = nb_to_tex.ConversionCache(str(tmpdir))
+    svg_data = b'<svg xmlns="http://www.w3.org/2000/svg"/>'
+    cache.store(svg_data, '.pdf', b'%PDF cached')
+    # no inkscape needed, the cached pdf is returned
+    assert nb_to_tex.convert_image('figure.svg', svg_data, cache) == (
+        'figure.pdf', b'%PDF cached')
+
+
+def test_convert_image_gif_to_jpg_in_memory(tmpdir):
+    Image = pytest.importorskip('PIL.Image')
+    gif_file = io.BytesIO()
+    Image.new('RGB', (4, 3), (255, 0, 0)).save(gif_file, format='GIF')
+    cache = nb_to_tex.ConversionCache(str(tmpdir))
+    filename, jpg_data = nb_to_tex.convert_image('anim.gif', gif_file.getvalue(), cache)
+    assert filename == 'anim.jpg'
+    jpg_image = Image.open(io.BytesIO(jpg_data))
+    assert jpg_image.format == 'JPEG'
+    assert jpg_image.size == (4, 3)
+    assert cache.load(gif_file.getvalue(), '.jpg') == jpg_data
+    # unsupported formats are kept
+    assert nb_to_tex.convert_image('plot.png', b'png data', cache) == ('plot.png', b'png data')
+
+
+class ImageHandler(BaseHTTPRequestHandler):
+    """Serves one image with an etag, counts requests and revalidations."""
+    requests = []
+
+    def do_GET(self):
+        ImageHandler.requests.append(self.headers.get('If-None-Match'))
+        if self.headers.get('If-None-Match') == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('ETag', '"v1"')
+        self.send_header('Content-Length', str(len(IMAGE_DATA)))
+        self.end_headers()
+        self.wfile.write(IMAGE_DATA)
+
+    def log_message(self, *args):
+        pass
+
+IMAGE_DATA = b'\x89PNG fake image'
+
+
+@pytest.fixture
+def image_url():
+    ImageHandler.requests = []
+    server = HTTPServer(('127.0.0.1', 0), ImageHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield 'http://127.0.0.1:{:d}/image.png'.format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
+def test_fetch_images_revalidates_cached_image(tmpdir, image_url):
+    image_cache = nb_to_tex.ImageCache(str(tmpdir))
+    assert nb_to_tex.fetch_images([image_url], image_cache) == {image_url: IMAGE_DATA}
+    assert nb_to_tex.fetch_images([image_url], image_cache) == {image_url: IMAGE_DATA}
+    # downloaded once, then answered with 304 not modified
+    assert ImageHandler.requests == [None, '"v1"']
+    assert image_cache.load(image_url) == (IMAGE_DATA, dict(url=image_url, etag='"v1"'))
+
+
+def test_fetch_images_offline_only_uses_cache(tmpdir, image_url):
+    image_cache = nb_to_tex.ImageCache(str(tmpdir))
+    assert nb_to_tex.fetch_images([image_url], image_cache, offline=True) == {image_url: None}
+    nb_to_tex.fetch_images([image_url], image_cache)
+    assert nb_to_tex.fetch_images([image_url], image_cache, offline=True) == {
+        image_url: IMAGE_DATA}
+    assert ImageHandler.requests == [None]
+
+
+def test_image_cache_evicts_least_recently_used(tmpdir, monkeypatch):
+    image_cache = nb_to_tex.ImageCache(str(tmpdir), max_bytes=20)
+    for i_url, url in enumerate(['http://a', 'http://b', 'http://c']):
+        image_cache.store(url, b'0123456789', dict())
+        data_filename, _ = image_cache._filenames(url)
+        os.utime(data_filename, (1000 + i_url, 1000 + i_url))
+    image_cache.evict()
+    assert image_cache.load('http://a') == (None, dict())
+    assert image_cache.load('http://b')[0] == b'0123456789'
+    assert image_cache.load('http://c')[0] == b'0123456789'
+    assert len(tmpdir.listdir()) == 4
+
+    # files removed by another process while evicting are skipped
+    image_cache.max_bytes = 0
+    vanished_filename, _ = image_cache._filenames('http://b')
+    getmtime = os.path.getmtime
+    def getmtime_vanished(filename):
+        if filename == vanished_filename:
+            raise OSError("No such file")
+        return getmtime(filename)
+    monkeypatch.setattr(os.path, 'getmtime', getmtime_vanished)
+    image_cache.evict()
+    assert image_cache.load('http://c') == (None, dict())
@@ -0,0 +1,18 @@
+import nb_watch
+
+
+def test_run_rebuild_returns_new_paths():
+    rebuilt = []
+    paths = nb_watch.run_rebuild(lambda: rebuilt.append(True),
+        lambda: ['a.ipynb', 'img.png'], ['a.ipynb'])
+    assert rebuilt == [True]
+    assert paths == ['a.ipynb', 'img.png']
+
+def test_run_rebuild_keeps_previous_paths_if_get_paths_fails():
+    def rebuild():
+        raise ValueError("broken notebook")
+
+    def get_paths():
+        raise ValueError("notebook is not valid json")
+    assert nb_watch.run_rebuild(rebuild, get_paths, ['a.ipynb', 'img.png']) == [
+        'a.ipynb', 'img.png']